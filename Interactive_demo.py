@@ -6,13 +6,36 @@
 
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.express as px
-from plotly.subplots import make_subplots
 import warnings
 import sys
 import io
 import os
+import json
+import hashlib
+import argparse
+import glob
+import pickle
+import gzip
+import shutil
+import multiprocessing
+import time
+import contextlib
+import cProfile
+import tracemalloc
+import threading
+import html
+import csv
+import re
+import importlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlsplit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+try:
+    import resource
+except ImportError:  # Windows 沒有 resource 模組，RSS 欄位改記為 None
+    resource = None
 
 # --- (上方的編碼設定、class InteractiveProcessMining、load_data 不變) ---
 
@@ -29,19 +52,1405 @@ if sys.platform.startswith('win'):
 
 warnings.filterwarnings('ignore')
 
+
+class _LazyModule:
+    """第一次取用屬性時才匯入的模組；plotly 匯入很慢，只有繪圖時才需要 (統計模式完全不載入)"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def load(self):
+        return importlib.import_module(self._name)
+
+
+go = _LazyModule('plotly.graph_objects')
+px = _LazyModule('plotly.express')
+plotly_subplots = _LazyModule('plotly.subplots')
+
+
+def _import_plotly():
+    """在建立 fork 行程池之前於主行程匯入 plotly，工作者直接繼承已載入的模組，不必各自再匯入一次"""
+    for module in (go, px, plotly_subplots):
+        module.load()
+
+
+def _max_rss_mb():
+    """目前行程的最高常駐記憶體 (MB)；Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def _figure_rows(fig):
+    """圖表實際送出的資料點數 (每條 trace 取最長的陣列欄位，Sankey 看連結數)"""
+    rows = 0
+    for trace in fig.data:
+        fields = trace.to_plotly_json()
+        # 只看第一層的資料陣列；marker 等巢狀設定裡的色階不算資料
+        values = list(fields.get('link', {}).values()) if 'link' in fields else fields.values()
+        rows += max((len(v) for v in values if isinstance(v, (list, tuple, np.ndarray, pd.Series, pd.Index))), default=0)
+    return rows
+
+
+class StageProfiler:
+    """逐階段記錄牆鐘時間、CPU 時間、記憶體峰值與輸入/輸出筆數，可輸出 JSON 或每階段的 cProfile 檔
+
+    記憶體欄位：max_rss_mb 為階段結束時行程的最高常駐記憶體，rss_growth_mb 為本階段推高的部分；
+    trace_memory 時另以 tracemalloc 記錄本階段內的配置峰值 (含 numpy 陣列，但會拖慢執行)。
+    """
+
+    def __init__(self, trace_memory=False, profile_dir=None):
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.records = []
+        self._depth = 0
+        self._started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        """量測一個階段；可在區塊內設定 record['rows_out'] (及 bytes_out 等其他欄位)"""
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        # 巢狀階段只計時，避免重設外層的 tracemalloc 峰值或重複啟動 cProfile
+        outermost = self._depth == 0
+        self._depth += 1
+        tracing = outermost and self.trace_memory
+        if tracing:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_base = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile() if outermost and self.profile_dir else None
+        rss_before = _max_rss_mb()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record['wall_s'] = round(time.perf_counter() - wall, 4)
+            record['cpu_s'] = round(time.process_time() - cpu, 4)
+            record['max_rss_mb'] = _max_rss_mb()
+            record['rss_growth_mb'] = None if rss_before is None else round(record['max_rss_mb'] - rss_before, 1)
+            record['tracemalloc_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - traced_base) / 1e6, 1) if tracing else None
+            record['pid'] = os.getpid()
+            self._depth -= 1
+            if profile is not None:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+                profile.dump_stats(os.path.join(self.profile_dir, f'{safe_name}.prof'))
+            self.records.append(record)
+
+    def extend(self, records):
+        """併入平行工作者回傳的階段紀錄"""
+        self.records.extend(records)
+
+    def write_json(self, path, **meta):
+        """將所有階段紀錄寫成 JSON，供排程系統比對各階段是否退化"""
+        report = dict(meta, stages=self.records, total_wall_s=round(time.perf_counter() - self._started, 4),
+                      max_rss_mb=_max_rss_mb())
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2, default=str)
+
+
+class _NullProfiler:
+    """不量測也不保存紀錄的 StageProfiler 替身
+
+    查詢伺服器的請求在多個執行緒中並行建構篩選後的分析器與圖表，共用同一個 StageProfiler
+    會讓 records 無限成長，巢狀深度與 cProfile/tracemalloc 狀態也會被並行修改。
+    """
+
+    trace_memory = False
+    profile_dir = None
+
+    @property
+    def records(self):
+        return []
+
+    @contextlib.contextmanager
+    def stage(self, name, rows_in=None):
+        yield {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+
+    def extend(self, records):
+        pass
+
+
+class CaseEngine:
+    """共用案例引擎：一次排序 + 向量化計算案例邊界、起訖時間、處理時間與相鄰動作配對"""
+
+    def __init__(self, df):
+        # 以 (案例ID, 紀錄時間) 排序一次；案例編碼依首次出現順序，與 df['案例ID'].unique() 一致
+        case_codes, case_ids = pd.factorize(df['案例ID'])
+        times = df['紀錄時間'].values
+        order = np.lexsort((times, case_codes))
+        self.sorted = df.iloc[order].reset_index(drop=True)
+        self.case_ids = np.asarray(case_ids)
+        codes = case_codes[order]
+        times = times[order]
+
+        # 案例邊界：每個案例在排序後陣列中的 [starts, ends) 區間
+        n = len(codes)
+        is_start = np.ones(n, dtype=bool)
+        if n > 0:
+            is_start[1:] = codes[1:] != codes[:-1]
+        self.starts = np.flatnonzero(is_start)
+        self.ends = np.append(self.starts[1:], n)
+        self.sizes = self.ends - self.starts
+        self.row_case = codes
+        self.times = times
+
+        # 每個案例的起訖時間與處理時間 (分鐘)
+        if n > 0:
+            first_times = times[self.starts]
+            last_times = times[self.ends - 1]
+        else:
+            first_times = last_times = times
+        durations = (last_times - first_times) / np.timedelta64(1, 's') / 60
+        self.cases = pd.DataFrame({
+            '案例ID': self.case_ids,
+            '病房': self.sorted['病房'].values[self.starts],
+            '開始時間': first_times,
+            '結束時間': last_times,
+            '事件數': self.sizes,
+            '處理時間(分鐘)': durations,
+        })
+
+        # 同一案例內的相鄰動作配對：記錄來源事件在排序後陣列中的位置 (目標為下一列)
+        self.pair_pos = np.flatnonzero(~is_start[1:])
+        self._pairs = None
+
+    @property
+    def pairs(self):
+        """相鄰動作配對 (source, target, 經過時間) 的 DataFrame，首次使用時才建立"""
+        if self._pairs is None:
+            src_pos = self.pair_pos
+            activities = self.sorted['動作'].values
+            self._pairs = pd.DataFrame({
+                'source': activities[src_pos],
+                'target': activities[src_pos + 1],
+                '經過時間(分鐘)': (self.times[src_pos + 1] - self.times[src_pos]) / np.timedelta64(1, 's') / 60,
+            })
+        return self._pairs
+
+
+def _sorted_group_quantile(values, starts, counts, q):
+    """各組 (已依值排序、組內連續) 的分位數，以線性內插計算 (與 np.percentile 預設相同)"""
+    pos = starts + q * (counts - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+# 變體雜湊的兩個底數 (64 位元多項式雜湊，溢位即取 mod 2^64)
+VARIANT_HASH_BASES = np.array([0x100000001B3, 0x9E3779B97F4A7C15], dtype=np.uint64)
+VARIANT_COVERAGE_SHARES = (0.5, 0.8, 0.95)
+
+
+def _activity_tokens(activities):
+    """每個動作名稱的穩定 64 位元代號 (與類別代碼無關，跨批次、跨執行一致)；最後一格對應缺值 (代碼 -1)"""
+    names = [str(a) for a in activities] + ['nan']
+    return np.array([int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for name in names], dtype=np.uint64)
+
+
+def _pow_u64(base, exponents):
+    """逐元素計算 base ** exponents (mod 2^64)，以平方乘法向量化"""
+    exponents = np.asarray(exponents, dtype=np.uint64).copy()
+    result = np.ones(len(exponents), dtype=np.uint64)
+    power = np.full(len(exponents), base, dtype=np.uint64)
+    while exponents.any():
+        odd = (exponents & np.uint64(1)).astype(bool)
+        result[odd] *= power[odd]
+        power *= power
+        exponents >>= np.uint64(1)
+    return result
+
+
+def _sequence_hashes(codes, starts, ends, tokens):
+    """把每段動作序列 codes[starts[i]:ends[i]] 壓成一組 (h1, h2) 雜湊
+
+    h = Σ token(a_j) · B^j (mod 2^64)，以兩個底數各算一次；各段需連續且涵蓋所有列。
+    兩段序列相接時 h(s + t) = h(s) + B^len(s) · h(t)，串流模式藉此接續跨批次的案例。
+    """
+    hashes = np.zeros((len(starts), 2), dtype=np.uint64)
+    if len(codes) == 0:
+        return hashes
+    sizes = ends - starts
+    pos = np.arange(len(codes)) - np.repeat(starts, sizes)
+    values = tokens[np.asarray(codes, dtype=np.intp)]
+    for k, base in enumerate(VARIANT_HASH_BASES):
+        powers = np.full(sizes.max(), base, dtype=np.uint64)
+        powers[0] = 1
+        powers = np.cumprod(powers, dtype=np.uint64)
+        hashes[:, k] = np.add.reduceat(values * powers[pos], starts)
+    return hashes
+
+
+def _concat_sequence_hashes(prefix, prefix_lengths, suffix):
+    """接續兩段序列的雜湊：h(s + t) = h(s) + B^len(s) · h(t)"""
+    result = np.empty_like(prefix)
+    for k, base in enumerate(VARIANT_HASH_BASES):
+        result[:, k] = prefix[:, k] + _pow_u64(base, prefix_lengths) * suffix[:, k]
+    return result
+
+
+def _variant_overview(table, k=20):
+    """由依案例數遞減排序的變體表計算佔比、累積佔比與涵蓋率 (涵蓋 50/80/95% 案例所需的變體數)，回傳前 k 名"""
+    counts = table['案例數'].values
+    total = int(counts.sum())
+    cumulative = np.cumsum(counts) / total if total else np.zeros(len(counts))
+    top = table.head(k).copy()
+    top['佔比'] = counts[:k] / total if total else 0.0
+    top['累積佔比'] = cumulative[:k]
+    coverage = {share: int(np.searchsorted(cumulative, share - 1e-9) + 1) for share in VARIANT_COVERAGE_SHARES} if total else {}
+    return {'top': top, 'num_variants': len(table), 'num_cases': total, 'coverage': coverage}
+
+
+class TraceVariants:
+    """流程變體 (trace variant) 引擎：案例的有序動作序列相同者視為同一變體
+
+    每個案例的序列以雙重 64 位元多項式雜湊壓成 (h1, h2) 鍵，分組、計數與處理時間
+    統計全以 lexsort/reduceat 向量化計算，不逐案例建立 Python list；路徑文字只在
+    繪圖時為前幾名變體還原。
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        codes, activities = pd.factorize(engine.sorted['動作'])
+        self.codes = codes
+        self.activities = np.asarray(activities, dtype=object)
+        hashes = _sequence_hashes(codes, engine.starts, engine.ends, _activity_tokens(self.activities))
+        durations = engine.cases['處理時間(分鐘)'].values
+        n_cases = len(engine.starts)
+
+        # 依 (h1, h2) 分組；同鍵內依案例順序，讓每組第一筆即為最早出現的代表案例
+        order = np.lexsort((np.arange(n_cases), hashes[:, 1], hashes[:, 0]))
+        keys = hashes[order]
+        is_start = np.ones(n_cases, dtype=bool)
+        if n_cases > 0:
+            is_start[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+        starts = np.flatnonzero(is_start)
+        counts = np.diff(np.r_[starts, n_cases])
+        first_case = order[starts]
+
+        # 變體依案例數遞減排序，同數者依首次出現先後
+        rank = np.lexsort((first_case, -counts))
+        group_rank = np.empty(len(rank), dtype=np.int64)
+        group_rank[rank] = np.arange(len(rank))
+        self.variant_of_case = np.empty(n_cases, dtype=np.int64)
+        self.variant_of_case[order] = group_rank[np.cumsum(is_start) - 1]
+
+        # 每個變體的處理時間統計 (組內依時間排序後取分位數)
+        by_variant = np.lexsort((durations, self.variant_of_case))
+        sorted_durations = durations[by_variant]
+        counts = counts[rank]
+        group_starts = np.r_[0, np.cumsum(counts)[:-1]].astype(np.int64) if len(counts) else np.empty(0, dtype=np.int64)
+        first_case = first_case[rank]
+        self.table = pd.DataFrame({
+            'h1': keys[starts][rank, 0] if n_cases else np.empty(0, dtype=np.uint64),
+            'h2': keys[starts][rank, 1] if n_cases else np.empty(0, dtype=np.uint64),
+            '案例數': counts,
+            '事件數': engine.sizes[first_case],
+            '平均處理時間(分鐘)': np.add.reduceat(sorted_durations, group_starts) / counts if len(counts) else np.empty(0),
+            '中位數處理時間(分鐘)': _sorted_group_quantile(sorted_durations, group_starts, counts, 0.5),
+            'P90處理時間(分鐘)': _sorted_group_quantile(sorted_durations, group_starts, counts, 0.9),
+            '代表案例': first_case,
+        })
+
+    def __len__(self):
+        return len(self.table)
+
+    def path(self, case):
+        """還原某個案例的動作路徑文字"""
+        start, end = self.engine.starts[case], self.engine.ends[case]
+        return ' → '.join(str(a) for a in self.activities[self.codes[start:end]])
+
+    def coverage(self, share):
+        """涵蓋指定比例案例所需的最少變體數"""
+        cumulative = np.cumsum(self.table['案例數'].values) / max(len(self.variant_of_case), 1)
+        return int(np.searchsorted(cumulative, share - 1e-9) + 1)
+
+    def overview(self, k=20):
+        """前 k 名變體 (含路徑、佔比、累積佔比與處理時間統計) 與整體涵蓋率"""
+        overview = _variant_overview(self.table, k)
+        overview['top']['路徑'] = [self.path(case) for case in overview['top']['代表案例']]
+        return overview
+
+
+class DirectlyFollowsGraph:
+    """直接跟隨圖 (DFG)：以整數編碼的動作累加轉換次數矩陣，並保留每條轉換的經過時間
+
+    每個轉換只以數個等長的 NumPy 陣列表示 (來源/目標動作代碼、來源病房代碼、
+    來源時間、經過分鐘數)，計數與統計皆以 bincount/lexsort 向量化計算。
+    """
+
+    def __init__(self, activities, wards, src, dst, ward, time, elapsed):
+        self.activities = np.asarray(activities)
+        self.wards = np.asarray(wards)
+        self.src = src
+        self.dst = dst
+        self.ward = ward
+        self.time = time
+        self.elapsed = elapsed
+
+    @classmethod
+    def from_case_engine(cls, engine):
+        """由共用案例引擎的相鄰配對建立 DFG"""
+        activity_codes, activities = pd.factorize(engine.sorted['動作'])
+        ward_codes, wards = pd.factorize(engine.sorted['病房'])
+        pos = engine.pair_pos
+        elapsed = (engine.times[pos + 1] - engine.times[pos]) / np.timedelta64(1, 's') / 60
+        return cls(activities, wards, activity_codes[pos].astype(np.int32), activity_codes[pos + 1].astype(np.int32),
+                   ward_codes[pos].astype(np.int32), engine.times[pos], elapsed)
+
+    def __len__(self):
+        return len(self.src)
+
+    def filter(self, wards=None, start=None, end=None):
+        """依來源事件的病房與時間區間 [start, end) 篩選，回傳新的 DFG"""
+        mask = np.ones(len(self), dtype=bool)
+        if wards is not None:
+            ward_ids = np.flatnonzero(np.isin(self.wards, list(wards)))
+            mask &= np.isin(self.ward, ward_ids)
+        if start is not None:
+            mask &= self.time >= np.datetime64(pd.Timestamp(start))
+        if end is not None:
+            mask &= self.time < np.datetime64(pd.Timestamp(end))
+        return DirectlyFollowsGraph(self.activities, self.wards, self.src[mask], self.dst[mask],
+                                    self.ward[mask], self.time[mask], self.elapsed[mask])
+
+    def matrix(self):
+        """動作 x 動作 的轉換次數矩陣 (列為來源、欄為目標)"""
+        n = len(self.activities)
+        key = self.src.astype(np.int64) * n + self.dst
+        return np.bincount(key, minlength=n * n).reshape(n, n)
+
+    def edge_stats(self):
+        """每條邊的次數與經過時間 (平均、中位數、P90，單位分鐘)"""
+        columns = ['source', 'target', 'value', '平均(分鐘)', '中位數(分鐘)', 'P90(分鐘)']
+        if len(self) == 0:
+            return pd.DataFrame(columns=columns)
+        n = len(self.activities)
+        key = self.src.astype(np.int64) * n + self.dst
+        order = np.lexsort((self.elapsed, key))
+        key = key[order]
+        elapsed = self.elapsed[order]
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        counts = np.diff(np.r_[starts, len(key)])
+
+        edges = key[starts]
+        return pd.DataFrame({
+            'source': self.activities[edges // n],
+            'target': self.activities[edges % n],
+            'value': counts,
+            '平均(分鐘)': np.add.reduceat(elapsed, starts) / counts,
+            '中位數(分鐘)': _sorted_group_quantile(elapsed, starts, counts, 0.5),
+            'P90(分鐘)': _sorted_group_quantile(elapsed, starts, counts, 0.9),
+        }, columns=columns)
+
+    def top_edges(self, k=20):
+        """次數最多的前 k 條邊"""
+        return self.edge_stats().sort_values('value', ascending=False, kind='stable').head(k).reset_index(drop=True)
+
+
+# 轉換等待時間的分箱：第 0 箱為不到 1 秒，第 k 箱涵蓋 [G^(k-1), G^k) 秒 (分位數相對誤差約 1%)，
+# 最後一箱另收納更長的等待 (1.02^719 秒約 16 天)
+WAIT_BIN_GROWTH = 1.02
+WAIT_BIN_COUNT = 720
+BOTTLENECK_QUANTILES = (0.5, 0.9, 0.99)
+# 瓶頸排名只納入次數至少這麼多的轉換，避免零星轉換的分位數造成誤判
+BOTTLENECK_MIN_COUNT = 20
+
+
+def _wait_bins(minutes):
+    """等待分鐘數所屬的分箱編號"""
+    seconds = np.asarray(minutes, dtype=np.float64) * 60
+    bins = np.zeros(len(seconds), dtype=np.int64)
+    positive = seconds >= 1
+    bins[positive] = 1 + np.floor(np.log(seconds[positive]) / np.log(WAIT_BIN_GROWTH)).astype(np.int64)
+    return np.minimum(bins, WAIT_BIN_COUNT - 1)
+
+
+def _wait_bin_values():
+    """各分箱的代表值 (分鐘)：第 0 箱為 0，其餘為箱內的幾何中點"""
+    values = WAIT_BIN_GROWTH ** (np.arange(WAIT_BIN_COUNT) - 0.5) / 60
+    values[0] = 0.0
+    return values
+
+
+class WaitingTimeSketch:
+    """轉換等待時間的可合併摘要：每個 (來源動作, 目標動作, 病房) 一列固定對數分箱的直方圖
+
+    病房取來源事件的病房 (與 DFG 相同)。分箱固定，因此兩份摘要 (不同批次、不同檔案) 只要
+    對齊列後相加即可合併，P50/P90/P99 由累積直方圖求得，不需保留每一筆等待時間。
+    """
+
+    KEY_NAMES = ['source', 'target', '病房']
+
+    def __init__(self, keys, counts, totals):
+        self.keys = keys
+        self.counts = counts
+        self.totals = totals
+
+    @classmethod
+    def empty(cls):
+        keys = pd.MultiIndex.from_arrays([np.empty(0, dtype=object)] * 3, names=cls.KEY_NAMES)
+        return cls(keys, np.zeros((0, WAIT_BIN_COUNT), dtype=np.int64), np.zeros(0))
+
+    @classmethod
+    def _from_codes(cls, activities, wards, src, dst, ward, minutes):
+        """由動作/病房代碼 (-1 為缺值，略過) 與等待分鐘數建立摘要"""
+        valid = (src >= 0) & (dst >= 0) & (ward >= 0)
+        n_activities, n_wards = len(activities), len(wards)
+        key = (src[valid].astype(np.int64) * n_activities + dst[valid]) * n_wards + ward[valid]
+        groups, group_of = np.unique(key, return_inverse=True)
+        counts = np.bincount(group_of * WAIT_BIN_COUNT + _wait_bins(minutes[valid]),
+                             minlength=len(groups) * WAIT_BIN_COUNT).reshape(len(groups), WAIT_BIN_COUNT)
+        totals = np.bincount(group_of, weights=minutes[valid], minlength=len(groups))
+        activities, wards = np.asarray(activities, dtype=object), np.asarray(wards, dtype=object)
+        keys = pd.MultiIndex.from_arrays([activities[groups // n_wards // n_activities],
+                                          activities[groups // n_wards % n_activities],
+                                          wards[groups % n_wards]], names=cls.KEY_NAMES)
+        return cls(keys, counts, totals)
+
+    @classmethod
+    def from_dfg(cls, dfg):
+        """由 DFG 的轉換陣列 (來源/目標動作代碼、來源病房代碼、經過分鐘數) 一次建立"""
+        return cls._from_codes(dfg.activities, dfg.wards, dfg.src, dfg.dst, dfg.ward, dfg.elapsed)
+
+    @classmethod
+    def from_transitions(cls, source, target, ward, minutes):
+        """由轉換的標籤陣列 (來源動作、目標動作、病房) 與等待分鐘數建立"""
+        n = len(source)
+        activity_codes, activities = pd.factorize(np.concatenate([np.asarray(source, dtype=object), np.asarray(target, dtype=object)]))
+        ward_codes, wards = pd.factorize(np.asarray(ward, dtype=object))
+        return cls._from_codes(activities, wards, activity_codes[:n], activity_codes[n:], ward_codes,
+                               np.asarray(minutes, dtype=np.float64))
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def merge(self, other):
+        """合併另一份摘要，回傳新的摘要"""
+        keys = self.keys.append(other.keys[~other.keys.isin(self.keys)])
+        counts = np.zeros((len(keys), WAIT_BIN_COUNT), dtype=np.int64)
+        totals = np.zeros(len(keys))
+        for sketch in (self, other):
+            rows = keys.get_indexer(sketch.keys)
+            counts[rows] += sketch.counts
+            totals[rows] += sketch.totals
+        return WaitingTimeSketch(keys, counts, totals)
+
+    def quantiles(self, q):
+        """各列等待時間的 q 分位數 (分鐘)，取累積次數首次達到 q 比例的分箱代表值"""
+        cumulative = np.cumsum(self.counts, axis=1)
+        rank = np.maximum(np.ceil(q * cumulative[:, -1]), 1) if len(cumulative) else np.zeros(0)
+        return _wait_bin_values()[(cumulative < rank[:, None]).sum(axis=1)]
+
+    def summary(self):
+        """每個轉換的次數、平均與 P50/P90/P99 等待時間 (分鐘)"""
+        counts = self.counts.sum(axis=1)
+        table = self.keys.to_frame(index=False)
+        table['次數'] = counts
+        table['平均(分鐘)'] = self.totals / np.maximum(counts, 1)
+        for q in BOTTLENECK_QUANTILES:
+            table[f'P{q * 100:g}(分鐘)'] = self.quantiles(q)
+        return table
+
+    def top(self, k=20, min_count=BOTTLENECK_MIN_COUNT):
+        """依 P90 等待時間排名的前 k 個轉換 (只納入次數達 min_count 者)"""
+        table = self.summary()
+        table = table[table['次數'] >= min_count]
+        return table.sort_values(['P90(分鐘)', '次數'], ascending=False, kind='stable').head(k).reset_index(drop=True)
+
+
+EVENT_COLUMNS = ['病歷號', '紀錄時間', '動作', '病房']
+
+
+def _is_csv(path):
+    return os.path.splitext(path)[1].lower() in ('.csv', '.txt')
+
+
+# 案例鍵 = (日期序號 << 32) | 病歷號代碼，以單一 int64 取代「病歷號_日期」字串
+CASE_KEY_SHIFT = 32
+CASE_KEY_MASK = (1 << CASE_KEY_SHIFT) - 1
+
+# 案例定義：病歷號 + 日期 (預設)、病歷號 + 病房、閒置間隔切分 (同一病歷號超過 N 分鐘沒有事件即為新案例)
+CASE_NOTION_LABELS = {'patient_day': '病歷號 + 日期', 'patient_ward': '病歷號 + 病房', 'session': '閒置間隔切分'}
+CASE_NOTIONS = tuple(CASE_NOTION_LABELS)
+DEFAULT_CASE_GAP_MINUTES = 120
+
+
+def _parse_times(values):
+    """解析紀錄時間：先以推斷出的單一格式向量化解析，格式不一致時才逐筆 (mixed) 解析"""
+    try:
+        return pd.to_datetime(values)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, format='mixed')
+
+
+def _to_category(series):
+    """轉為類別型 (整數代碼 + 對照表)；類別依首次出現順序排列，與 unique()/value_counts() 的同數順序一致"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    codes, uniques = pd.factorize(series)
+    return pd.Series(pd.Categorical.from_codes(codes, uniques), index=series.index, name=series.name)
+
+
+def _encode_patients(series, patients=None):
+    """將病歷號編成整數代碼；給定既有對照表時沿用並附加新病歷號，讓跨批次的代碼保持一致"""
+    if patients is None:
+        codes, patients = pd.factorize(series)
+        return codes, pd.Index(patients)
+    codes = patients.get_indexer(series)
+    new = pd.unique(series[(codes < 0) & series.notna().values])
+    if len(new) > 0:
+        patients = patients.append(pd.Index(new))
+        codes = patients.get_indexer(series)
+    return codes, patients
+
+
+def _decode_case_keys(keys, patients):
+    """由案例鍵還原 (病歷號, 日期)；只在繪圖時使用"""
+    keys = np.asarray(keys, dtype=np.int64)
+    codes = keys & CASE_KEY_MASK
+    known = codes < len(patients)
+    patient_values = np.full(len(keys), None, dtype=object)
+    patient_values[known] = np.asarray(patients, dtype=object)[codes[known]]
+    return patient_values, (keys >> CASE_KEY_SHIFT).astype('datetime64[D]')
+
+
+def _case_keys(df, notion='patient_day', gap_minutes=DEFAULT_CASE_GAP_MINUTES):
+    """依案例定義計算 int64 案例鍵；低 32 位元一律為病歷號代碼 (供 _decode_case_keys 還原病歷號)
+
+    patient_day 的高位元為日期序號、patient_ward 為病房代碼；session 先依 (病歷號, 紀錄時間) 排序一次，
+    病歷號改變或與前一事件相隔超過 gap_minutes 分鐘處即為新案例，高位元為以 cumsum 編出的案例序號。
+    """
+    patient_codes = df['病歷號'].cat.codes.values.astype(np.int64) & CASE_KEY_MASK
+    if notion == 'patient_day':
+        high = df['日期'].values.astype('datetime64[D]').astype(np.int64)
+    elif notion == 'patient_ward':
+        high = df['病房'].cat.codes.values.astype(np.int64)
+    elif notion == 'session':
+        times = df['紀錄時間'].values
+        order = np.lexsort((times, patient_codes))
+        sorted_patients = patient_codes[order]
+        is_new = np.ones(len(order), dtype=bool)
+        if len(order) > 1:
+            gaps = np.diff(times[order]) > np.timedelta64(int(round(gap_minutes * 60)), 's')
+            is_new[1:] = (sorted_patients[1:] != sorted_patients[:-1]) | gaps
+        high = np.empty(len(order), dtype=np.int64)
+        high[order] = np.cumsum(is_new) - 1
+    else:
+        raise ValueError(f"未知的案例定義: {notion} (可用: {', '.join(CASE_NOTIONS)})")
+    return (high << CASE_KEY_SHIFT) | patient_codes
+
+
+def _derive_event_columns(df, patients=None):
+    """解析紀錄時間、依時間排序，並衍生精簡的事件欄位
+
+    動作/病房/病歷號 轉為類別型 (整數代碼 + 對照表)，日期為 datetime64，
+    案例ID 為 int64 案例鍵，小時/星期 為 int8 (星期一 = 0)；字串只在繪圖時才還原。
+    patients 為既有的病歷號對照表 (串流模式跨批次沿用)。
+    """
+    df['紀錄時間'] = _parse_times(df['紀錄時間'])
+    df = df.sort_values('紀錄時間', kind='stable').reset_index(drop=True)
+    day = df['紀錄時間'].values.astype('datetime64[D]')
+    patient_codes, patients = _encode_patients(df['病歷號'], patients)
+    df['病歷號'] = pd.Categorical.from_codes(patient_codes, patients)
+    df['動作'] = _to_category(df['動作'])
+    df['病房'] = _to_category(df['病房'])
+    df['日期'] = day
+    df['案例ID'] = _case_keys(df)
+    df['小時'] = df['紀錄時間'].dt.hour.astype(np.int8)
+    df['星期'] = df['紀錄時間'].dt.dayofweek.astype(np.int8)
+    return df
+
+
+CACHE_VERSION = 2
+
+
+def _file_fingerprint(path):
+    """計算來源檔案指紋 (路徑、大小、修改時間、內容雜湊)"""
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+
+def _save_frame_npz(df, cache_path, fingerprint):
+    """將已衍生欄位的 DataFrame 以欄式 .npz 存到快取 (不使用 pickle)"""
+    arrays = {}
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        key = f'col{i}'
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            kind = 'category'
+            categories = series.cat.categories
+            arrays[key] = series.cat.codes.values
+            arrays[key + '_categories'] = (categories.values if pd.api.types.is_numeric_dtype(categories)
+                                           else categories.astype(str).to_numpy(dtype=object).astype('U'))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            kind = 'datetime'
+            arrays[key] = series.values
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            kind = 'num'
+            arrays[key] = series.values
+        else:
+            kind = 'str'
+            arrays[key] = series.astype(str).to_numpy(dtype=object).astype('U')
+            arrays[key + '_null'] = series.isna().values
+        columns.append({'name': str(col), 'key': key, 'kind': kind})
+    meta = {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'columns': columns}
+    arrays['meta'] = np.array(json.dumps(meta, ensure_ascii=False))
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+def _load_frame_npz(cache_path, fingerprint):
+    """讀取 .npz 快取；指紋不符或格式錯誤時回傳 None"""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != CACHE_VERSION or meta.get('fingerprint') != fingerprint:
+                return None
+            frame = {}
+            for col in meta['columns']:
+                values = data[col['key']]
+                if col['kind'] == 'category':
+                    categories = data[col['key'] + '_categories']
+                    categories = pd.Index(categories.tolist() if categories.dtype.kind == 'U' else categories)
+                    frame[col['name']] = pd.Categorical.from_codes(values, categories)
+                elif col['kind'] == 'str':
+                    series = pd.Series(values.tolist())
+                    frame[col['name']] = series.where(~data[col['key'] + '_null'], None)
+                else:
+                    frame[col['name']] = values
+            return pd.DataFrame(frame)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"快取檔案無法讀取，將重新解析來源檔案: {e}")
+        return None
+
+
+STORE_VERSION = 1
+STORE_INDEX = 'store.json'
+
+
+class EventStore:
+    """依月份分區的磁碟事件庫：每個分區一個目錄，各欄以 .npy 存放 (可記憶體映射)
+
+    store.json 記錄欄位與各分區的筆數、最早/最晚紀錄時間；類別欄只存整數代碼，
+    對照表全庫共用 (存於根目錄)，因此各分區的案例鍵一致、可直接串接。
+    載入時依日期區間挑出需要的分區，邊界分區再以二分搜尋截取，只有區間內的列會讀進記憶體。
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, STORE_INDEX), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"事件庫版本不符 ({meta.get('version')})")
+        self.store_dir = store_dir
+        self.columns = meta['columns']
+        self.partitions = meta['partitions']
+        self._categories = {}
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isfile(os.path.join(path, STORE_INDEX))
+
+    def __len__(self):
+        return sum(p['rows'] for p in self.partitions)
+
+    def _column(self, name):
+        return next(c for c in self.columns if c['name'] == name)
+
+    def categories(self, column):
+        """類別欄的對照表 (第一次用到時才讀取)"""
+        key = column['key']
+        if key not in self._categories:
+            values = np.load(os.path.join(self.store_dir, key + '_categories.npy'), allow_pickle=False)
+            self._categories[key] = pd.Index(values.tolist() if values.dtype.kind == 'U' else values)
+        return self._categories[key]
+
+    def select(self, start=None, end=None):
+        """與 [start, end) 有交集的分區"""
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        return [p for p in self.partitions
+                if (start is None or pd.Timestamp(p['max_time']) >= start)
+                and (end is None or pd.Timestamp(p['min_time']) < end)]
+
+    def _partition_arrays(self, partition, start=None, end=None):
+        """以記憶體映射開啟分區各欄，並截取 [start, end) 的列 (回傳的仍是映射的切片)"""
+        folder = os.path.join(self.store_dir, partition['name'])
+        arrays = {c['key']: np.load(os.path.join(folder, c['key'] + '.npy'), mmap_mode='r') for c in self.columns}
+        times = arrays[self._column('紀錄時間')['key']]
+        lo = 0 if start is None else int(np.searchsorted(times, np.datetime64(pd.Timestamp(start)), side='left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, np.datetime64(pd.Timestamp(end)), side='left'))
+        return {key: values[lo:hi] for key, values in arrays.items()}
+
+    def load(self, start=None, end=None):
+        """載入 [start, end) 的事件 (欄位與 _derive_event_columns 相同)，回傳 (DataFrame, 讀取的分區數)"""
+        partitions = self.select(start, end)
+        pieces = [self._partition_arrays(p, start, end) for p in partitions]
+        frame = {}
+        for column in self.columns:
+            if pieces:
+                values = np.concatenate([piece[column['key']] for piece in pieces])
+            else:
+                values = np.empty(0, dtype=column['dtype'])
+            if column['kind'] == 'category':
+                frame[column['name']] = pd.Categorical.from_codes(values, self.categories(column))
+            else:
+                frame[column['name']] = values
+        return pd.DataFrame(frame), len(partitions)
+
+    @classmethod
+    def write(cls, df, store_dir, append=False):
+        """將已衍生欄位的事件表依月份寫入事件庫，回傳寫入的分區數
+
+        append 時併入既有事件庫：類別對照表附加新值、案例鍵依新的病歷號代碼重算，
+        與既有月份重疊的分區會與舊資料合併後依時間重新排序改寫；否則覆寫整個事件庫。
+        """
+        old = cls(store_dir) if cls.is_store(store_dir) else None
+        if append and old is not None and sorted(c['name'] for c in old.columns) != sorted(map(str, df.columns)):
+            raise ValueError("欄位與既有事件庫不一致，無法附加")
+        base = old if append else None
+
+        columns, arrays, tables = [], {}, {}
+        for i, name in enumerate(df.columns):
+            series = df[name]
+            key = base._column(str(name))['key'] if base is not None else f'col{i}'
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                kind = 'category'
+                table = pd.Index(series.cat.categories)
+                codes = series.cat.codes.values.astype(np.int32)
+                if base is not None:
+                    table = base.categories(base._column(str(name)))
+                    mapping, table = _encode_patients(pd.Series(series.cat.categories), table)
+                    codes = np.where(codes >= 0, mapping[codes], -1).astype(np.int32)
+                tables[key] = table
+                values = codes
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                kind = 'datetime'
+                values = series.values
+            elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+                kind = 'num'
+                values = series.values
+            else:
+                raise ValueError(f"事件庫不支援文字欄位 {name}")
+            arrays[key] = values
+            columns.append({'name': str(name), 'key': key, 'kind': kind, 'dtype': values.dtype.str})
+
+        by_name = {c['name']: c['key'] for c in columns}
+        if base is not None and '案例ID' in by_name:
+            # 案例鍵內含病歷號代碼，附加時依全庫共用的代碼重算
+            day = arrays[by_name['日期']].astype('datetime64[D]').astype(np.int64)
+            arrays[by_name['案例ID']] = (day << CASE_KEY_SHIFT) | (arrays[by_name['病歷號']].astype(np.int64) & CASE_KEY_MASK)
+
+        times = arrays[by_name['紀錄時間']]
+        order = np.argsort(times, kind='stable')
+        if not (order == np.arange(len(order))).all():
+            arrays = {key: values[order] for key, values in arrays.items()}
+            times = arrays[by_name['紀錄時間']]
+        months = times.astype('datetime64[M]')
+        bounds = np.flatnonzero(np.r_[True, months[1:] != months[:-1], True])
+
+        os.makedirs(store_dir, exist_ok=True)
+        existing = {p['name']: p for p in base.partitions} if base is not None else {}
+        written = {}
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            name = str(months[lo])
+            part = {key: values[lo:hi] for key, values in arrays.items()}
+            if name in existing:
+                previous = base._partition_arrays(existing[name])
+                part = {key: np.concatenate([np.asarray(previous[key]), values]) for key, values in part.items()}
+                merged_order = np.argsort(part[by_name['紀錄時間']], kind='stable')
+                part = {key: values[merged_order] for key, values in part.items()}
+            folder = os.path.join(store_dir, name)
+            os.makedirs(folder, exist_ok=True)
+            for key, values in part.items():
+                tmp_path = os.path.join(folder, key + '.tmp.npy')
+                np.save(tmp_path, values)
+                os.replace(tmp_path, os.path.join(folder, key + '.npy'))
+            part_times = part[by_name['紀錄時間']]
+            written[name] = {'name': name, 'rows': int(len(part_times)),
+                             'min_time': str(part_times[0]), 'max_time': str(part_times[-1])}
+
+        for key, table in tables.items():
+            values = (table.values if pd.api.types.is_numeric_dtype(table)
+                      else table.astype(str).to_numpy(dtype=object).astype('U'))
+            tmp_path = os.path.join(store_dir, key + '_categories.tmp.npy')
+            np.save(tmp_path, values)
+            os.replace(tmp_path, os.path.join(store_dir, key + '_categories.npy'))
+
+        partitions = dict(existing)
+        partitions.update(written)
+        meta = {'version': STORE_VERSION, 'columns': columns,
+                'partitions': [partitions[name] for name in sorted(partitions)]}
+        tmp_path = os.path.join(store_dir, STORE_INDEX + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, os.path.join(store_dir, STORE_INDEX))
+
+        if old is not None and not append:
+            # 覆寫時移除舊索引列出、但這次沒有寫到的分區
+            for name in {p['name'] for p in old.partitions} - set(written):
+                shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
+        return len(written)
+
+
+def _codes_with_missing(series):
+    """類別代碼與標籤；有缺值時把代碼 -1 改指向附加在最後的 NaN 標籤"""
+    series = _to_category(series)
+    codes = series.cat.codes.values.astype(np.intp)
+    labels = pd.Index(series.cat.categories, dtype=object)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels = labels.append(pd.Index([np.nan], dtype=object))
+    return codes, labels
+
+
+def _labels_to_npz(labels):
+    """標籤存成字串陣列與缺值遮罩 (不使用 pickle)"""
+    labels = pd.Index(labels, dtype=object)
+    return labels.astype(str).to_numpy(dtype=object).astype('U'), np.asarray(labels.isna())
+
+
+def _labels_from_npz(values, nulls):
+    return pd.Index([np.nan if null else value for value, null in zip(values.tolist(), nulls.tolist())], dtype=object)
+
+
+class EventCube:
+    """事件立方體：(病房 × 動作 × 日期 × 小時) 的事件計數，所有計數類圖表都由它切片而來
+
+    日期決定星期，因此 (日期, 小時) 即涵蓋「星期 × 時段」；日期軸為連續的日序號區間。
+    立方體可存成 .npz，也可與其他立方體合併 (標籤取聯集、日期區間取聯集)，
+    篩選病房/動作/日期區間只需對陣列切片，不必重新掃描事件表。
+    """
+
+    def __init__(self, wards, activities, first_day, counts):
+        self.wards = pd.Index(wards, dtype=object)
+        self.activities = pd.Index(activities, dtype=object)
+        self.first_day = np.datetime64(first_day, 'D') if first_day is not None else None
+        self.counts = counts
+
+    @classmethod
+    def from_events(cls, df):
+        """以合併後的整數代碼做一次 bincount 建立立方體"""
+        ward_codes, wards = _codes_with_missing(df['病房'])
+        activity_codes, activities = _codes_with_missing(df['動作'])
+        if len(df) == 0:
+            return cls(wards, activities, None, np.zeros((len(wards), len(activities), 0, 24), dtype=np.int32))
+        day = df['日期'].values.astype('datetime64[D]').astype(np.int64)
+        first_day = day.min()
+        n_days = int(day.max() - first_day + 1)
+        shape = (len(wards), len(activities), n_days, 24)
+        flat = ((ward_codes * shape[1] + activity_codes) * n_days + (day - first_day)) * 24 + df['小時'].values
+        counts = np.bincount(flat, minlength=int(np.prod(shape))).astype(np.int32).reshape(shape)
+        return cls(wards, activities, np.datetime64(int(first_day), 'D'), counts)
+
+    @property
+    def dates(self):
+        if self.first_day is None:
+            return np.empty(0, dtype='datetime64[D]')
+        return self.first_day + np.arange(self.counts.shape[2])
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def filter(self, wards=None, activities=None, start=None, end=None):
+        """篩選病房、動作與日期區間 [start, end)，回傳新的立方體 (只做陣列切片)"""
+        counts = self.counts
+        ward_labels, activity_labels = self.wards, self.activities
+        if wards is not None:
+            keep = np.flatnonzero(self.wards.isin(list(wards)))
+            counts, ward_labels = counts[keep], self.wards[keep]
+        if activities is not None:
+            keep = np.flatnonzero(self.activities.isin(list(activities)))
+            counts, activity_labels = counts[:, keep], self.activities[keep]
+        first_day = self.first_day
+        if first_day is not None and (start is not None or end is not None):
+            dates = self.dates
+            lo = 0 if start is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(start).date(), 'D')))
+            hi = len(dates) if end is None else int(np.searchsorted(dates, np.datetime64(pd.Timestamp(end).date(), 'D')))
+            hi = max(hi, lo)
+            counts = counts[:, :, lo:hi]
+            first_day = dates[lo] if hi > lo else None
+        return EventCube(ward_labels, activity_labels, first_day, counts)
+
+    def merge(self, other):
+        """合併另一個立方體 (例如另一批次或另一個檔案)，回傳新的立方體"""
+        if other.first_day is None:
+            return self
+        if self.first_day is None:
+            return other
+        wards = self.wards.append(other.wards[~other.wards.isin(self.wards)])
+        activities = self.activities.append(other.activities[~other.activities.isin(self.activities)])
+        first_day = min(self.first_day, other.first_day)
+        last_day = max(self.dates[-1], other.dates[-1])
+        merged = np.zeros((len(wards), len(activities), int((last_day - first_day).astype(int)) + 1, 24), dtype=np.int32)
+        for cube in (self, other):
+            offset = int((cube.first_day - first_day).astype(int))
+            days = np.arange(offset, offset + cube.counts.shape[2])
+            merged[np.ix_(wards.get_indexer(cube.wards), activities.get_indexer(cube.activities), days, np.arange(24))] += cube.counts
+        return EventCube(wards, activities, first_day, merged)
+
+    @staticmethod
+    def _label_counts(labels, counts):
+        """依次數遞減 (同數者依標籤順序) 的計數，略過缺值標籤與零計數"""
+        counts = pd.Series(counts.astype(np.int64), index=labels, name='count')
+        counts = counts[(counts > 0) & labels.notna()]
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def activity_counts(self):
+        return self._label_counts(self.activities, self.counts.sum(axis=(0, 2, 3)))
+
+    def ward_counts(self):
+        return self._label_counts(self.wards, self.counts.sum(axis=(1, 2, 3)))
+
+    def daily_counts(self):
+        """每日事件數 (以 datetime.date 為索引，只含有事件的日期)"""
+        per_day = self.counts.sum(axis=(0, 1, 3)).astype(np.int64)
+        keep = per_day > 0
+        return pd.Series(per_day[keep], index=pd.DatetimeIndex(self.dates[keep]).date)
+
+    def hour_weekday(self):
+        """7x24 (星期一..星期日 x 0..23 時) 計數矩陣"""
+        per_day_hour = self.counts.sum(axis=(0, 1)).astype(np.int64)
+        # 1970-01-01 為星期四 (星期一 = 0)
+        weekday = (self.dates.astype(np.int64) + 3) % 7
+        hour_weekday = np.zeros((7, 24), dtype=np.int64)
+        np.add.at(hour_weekday, weekday, per_day_hour)
+        return hour_weekday
+
+    def save(self, path, fingerprint=None):
+        """存成 .npz (不使用 pickle)；fingerprint 為來源檔案指紋，讀取時用來判斷是否仍有效"""
+        wards, ward_nulls = _labels_to_npz(self.wards)
+        activities, activity_nulls = _labels_to_npz(self.activities)
+        meta = {'version': CACHE_VERSION, 'fingerprint': fingerprint,
+                'first_day': None if self.first_day is None else str(self.first_day)}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, counts=self.counts, wards=wards, ward_nulls=ward_nulls, activities=activities,
+                     activity_nulls=activity_nulls, meta=np.array(json.dumps(meta, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """讀取 .npz 立方體；不存在、版本或指紋不符時回傳 None"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                if meta.get('version') != CACHE_VERSION or (fingerprint is not None and meta.get('fingerprint') != fingerprint):
+                    return None
+                return cls(_labels_from_npz(data['wards'], data['ward_nulls']),
+                           _labels_from_npz(data['activities'], data['activity_nulls']),
+                           meta['first_day'], data['counts'])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"立方體檔案無法讀取，將重新建立: {e}")
+            return None
+
+
+# 精簡模式：每個病房的處理時間最多保留的樣本數，以及密度曲線的解析度
+DURATION_SAMPLE_LIMIT = 200_000
+DENSITY_GRID_POINTS = 100
+
+
+def _reservoir_update(samples, seen, values, limit, rng):
+    """水庫抽樣 (Algorithm R) 的向量化版本：把一批新值併入最多 limit 筆的均勻樣本
+
+    samples 為目前樣本、seen 為至今看過的總筆數，回傳 (新樣本, 新總筆數)。
+    """
+    values = np.asarray(values, dtype=float)
+    room = max(limit - len(samples), 0)
+    samples = np.concatenate([samples, values[:room]])
+    rest = values[room:]
+    if len(rest) > 0:
+        # 第 i 筆 (從 0 起算) 以 limit / (i + 1) 的機率取代樣本中的隨機一筆
+        index = np.arange(seen + room, seen + len(values))
+        slot = rng.integers(0, index + 1)
+        hit = slot < limit
+        samples[slot[hit]] = rest[hit]
+    return samples, seen + len(values)
+
+
+def _reservoir_merge(samples_a, seen_a, samples_b, seen_b, limit, rng):
+    """合併兩份水庫樣本：依兩邊看過的筆數以超幾何分布決定各取幾筆，結果仍為全體的均勻樣本"""
+    total = min(limit, seen_a + seen_b)
+    if len(samples_a) + len(samples_b) <= total:
+        return np.concatenate([samples_a, samples_b]), seen_a + seen_b
+    take_a = rng.hypergeometric(seen_a, seen_b, total) if seen_a and seen_b else (total if seen_a else 0)
+    merged = np.concatenate([rng.choice(samples_a, take_a, replace=False), rng.choice(samples_b, total - take_a, replace=False)])
+    return merged, seen_a + seen_b
+
+
+def _summarize_distribution(values, max_samples=DURATION_SAMPLE_LIMIT, grid_points=DENSITY_GRID_POINTS, rng=None):
+    """以 NumPy 在伺服器端計算分布摘要：四分位數、箱形圖鬚線、平均與固定解析度的核密度
+
+    超過 max_samples 筆時先均勻抽樣；密度以分箱後的高斯核估計，成本與資料量呈線性，
+    輸出大小只取決於 grid_points。帶寬採 Silverman 法則 (與 plotly.js violin 預設相同)。
+    """
+    values = np.asarray(values, dtype=float)
+    count = len(values)
+    if count > max_samples:
+        rng = rng or np.random.default_rng(0)
+        values = rng.choice(values, max_samples, replace=False)
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    std = values.std(ddof=1) if len(values) > 1 else 0.0
+    bandwidth = 1.059 * min(std, iqr / 1.349) * len(values) ** -0.2
+    if bandwidth <= 0:
+        bandwidth = 1.059 * std * len(values) ** -0.2 if std > 0 else 1.0
+
+    low, high = values.min() - 2 * bandwidth, values.max() + 2 * bandwidth
+    grid = np.linspace(low, high, grid_points)
+    hist, edges = np.histogram(values, bins=1024, range=(low, high))
+    centers = (edges[:-1] + edges[1:]) / 2
+    kernel = np.exp(-0.5 * ((grid[:, None] - centers[None, :]) / bandwidth) ** 2)
+    density = kernel @ hist / (len(values) * bandwidth * np.sqrt(2 * np.pi))
+    return {
+        'count': count,
+        'q1': q1, 'median': median, 'q3': q3, 'mean': values.mean(),
+        'lowerfence': values[values >= q1 - 1.5 * iqr].min(),
+        'upperfence': values[values <= q3 + 1.5 * iqr].max(),
+        'grid': grid, 'density': density,
+    }
+
+
+def _merge_timeline_runs(timeline_df):
+    """把同一案例中連續、相同動作與病房的事件合併成一個區段 (畫面相同，長條數大幅減少)"""
+    if timeline_df.empty:
+        return timeline_df.assign(Events=pd.Series(dtype='int64'))
+    keys = timeline_df[['Case', 'Activity', 'Ward']]
+    new_run = (keys != keys.shift()).any(axis=1).values
+    run_id = np.cumsum(new_run) - 1
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(timeline_df)) - 1
+    merged = timeline_df.iloc[starts].reset_index(drop=True)
+    merged['Finish'] = timeline_df['Finish'].values[ends]
+    merged['Events'] = np.bincount(run_id)
+    return merged
+
+
+# 時間軸的案例抽樣方式 (標題文字)，以及改用 WebGL 繪製的長條數門檻
+TIMELINE_SAMPLING_LABELS = {
+    'first': '前{n}個案例',
+    'random': '隨機抽樣 {n} 個案例',
+    'stratified': '依病房分層抽樣 {n} 個案例',
+    'longest': '事件最多的 {n} 個案例',
+    'slowest': '處理時間最長的 {n} 個案例',
+}
+TIMELINE_SAMPLINGS = tuple(TIMELINE_SAMPLING_LABELS)
+TIMELINE_WEBGL_MIN_BARS = 1000
+
+
+def _sample_timeline_cases(engine, n_cases=20, sampling='first', rng=None):
+    """依抽樣方式選出時間軸要顯示的案例，回傳案例編號 (engine 中的位置) 並依顯示順序排列
+
+    first：最早開始的 n_cases 個案例；random：以水庫抽樣均勻抽出；stratified：各病房依案例數比例分配名額
+    後各自水庫抽樣 (病房取案例第一筆事件的病房)；longest / slowest：事件數 / 處理時間最多的案例。
+    """
+    total = len(engine.case_ids)
+    n_cases = min(n_cases, total)
+    rng = rng if rng is not None else np.random.default_rng(0)
+    if sampling == 'first':
+        return np.arange(n_cases)
+    if sampling == 'random':
+        picked, _ = _reservoir_update(np.empty(0), 0, np.arange(total), n_cases, rng)
+        return np.sort(picked.astype(np.int64))
+    if sampling == 'stratified':
+        ward_codes, _ = pd.factorize(engine.cases['病房'], use_na_sentinel=False)
+        sizes = np.bincount(ward_codes)
+        # 最大餘數法分配名額，總和剛好為 n_cases
+        share = sizes * n_cases / max(total, 1)
+        quota = np.floor(share).astype(np.int64)
+        quota[np.argsort(quota - share, kind='stable')[:n_cases - quota.sum()]] += 1
+        order = np.argsort(ward_codes, kind='stable')
+        bounds = np.append(0, np.cumsum(sizes))
+        picked = [np.sort(_reservoir_update(np.empty(0), 0, order[bounds[i]:bounds[i + 1]], quota[i], rng)[0].astype(np.int64))
+                  for i in range(len(sizes))]
+        return np.concatenate(picked) if picked else np.empty(0, dtype=np.int64)
+    if sampling == 'longest':
+        return np.argsort(-engine.sizes, kind='stable')[:n_cases]
+    if sampling == 'slowest':
+        return np.argsort(-engine.cases['處理時間(分鐘)'].values, kind='stable')[:n_cases]
+    raise ValueError(f"未知的時間軸抽樣方式: {sampling} (可用: {', '.join(TIMELINE_SAMPLINGS)})")
+
+
+def _timeline_gl_traces(timeline_df):
+    """WebGL 版甘特圖：每種動作一條 Scattergl 折線，每個事件區段為 (開始, 結束) 兩點並以 None 斷開"""
+    traces = []
+    extra = ['Events'] if 'Events' in timeline_df else []
+    for activity, group in timeline_df.groupby('Activity', sort=False):
+        n = len(group)
+        x = np.empty(3 * n, dtype=object)
+        x[0::3] = pd.to_datetime(group['Start']).dt.strftime('%Y-%m-%d %H:%M:%S').values
+        x[1::3] = pd.to_datetime(group['Finish']).dt.strftime('%Y-%m-%d %H:%M:%S').values
+        x[2::3] = None
+        y = np.repeat(group['Case'].values, 3).astype(object)
+        y[2::3] = None
+        customdata = np.repeat(group[['Ward'] + extra].values, 3, axis=0).astype(object)
+        customdata[2::3] = None
+        hovertemplate = (f'<b>%{{y}}</b><br>動作: {activity}<br>病房: %{{customdata[0]}}<br>時間: %{{x}}'
+                         + ('<br>事件數: %{customdata[1]}' if extra else '') + '<extra></extra>')
+        traces.append(go.Scattergl(x=x, y=y, mode='lines', name=str(activity), customdata=customdata,
+                                   hovertemplate=hovertemplate, connectgaps=False))
+    return traces
+
+
+# 儀表板分頁代號與對應的圖表建構方法
+DASHBOARD_BUILDERS = [
+    ('pie', '_build_activity_pie_chart'),
+    ('bar', '_build_ward_bar_chart'),
+    ('sankey', '_build_process_flow_network'),
+    ('variants', '_build_variant_chart'),
+    ('bottleneck', '_build_bottleneck_chart'),
+    ('timeline', '_build_activity_timeline'),
+    ('heatmap', '_build_performance_heatmap'),
+    ('violin', '_build_duration_violin_plot'),
+    ('trend', '_build_daily_trend_scatter'),
+]
+
+# 平行建構時，工作者經由 fork 繼承此物件，而不是逐一序列化傳遞
+_PARALLEL_TOOL = None
+# 病房儀表板分派時的 {病房 (全院為 None): 分析器}，同樣經由 fork 繼承
+_PARALLEL_WARD_VIEWS = None
+
+
+def _figure_to_fragment(fig):
+    """將圖表轉換為 HTML div 片段"""
+    # include_plotlyjs=False 確保 JS 不會被重複加載
+    # config={'responsive': True} 嘗試讓圖表自適應
+    return fig.to_html(full_html=False, include_plotlyjs=False, config={'responsive': True})
+
+
+def _build_fragment_in_worker(key, method, lazy=False):
+    """工作者：建構單一圖表並直接轉成 HTML 片段或 JSON (序列化也在工作者中完成)，連同階段紀錄一併回傳"""
+    parent = _PARALLEL_TOOL.profiler
+    # 執行緒共用同一個行程，無法各自啟動 cProfile 或 tracemalloc，只記錄時間與筆數
+    if multiprocessing.parent_process() is not None:
+        profiler = StageProfiler(parent.trace_memory, parent.profile_dir)
+    else:
+        profiler = StageProfiler()
+    with profiler.stage(method, rows_in=len(_PARALLEL_TOOL.df)) as record:
+        fig = getattr(_PARALLEL_TOOL, method)()
+    record['rows_out'] = _figure_rows(fig)
+    with profiler.stage(f'to_json:{key}' if lazy else f'to_html:{key}', rows_in=record['rows_out']) as record:
+        fragment = fig.to_json() if lazy else _figure_to_fragment(fig)
+        record['bytes_out'] = len(fragment)
+    return key, fragment, profiler.records
+
+
+def _write_ward_dashboard_in_worker(ward, output_path, lazy=False, compress=False, nav_html=''):
+    """工作者：建構單一病房 (全院為 None) 的所有圖表並寫出儀表板頁面，回傳階段紀錄"""
+    view = _PARALLEL_WARD_VIEWS[ward]
+    in_subprocess = multiprocessing.parent_process() is not None
+    if in_subprocess:
+        profiler = StageProfiler(view.profiler.trace_memory, view.profiler.profile_dir)
+    else:
+        profiler = StageProfiler()
+    view.profiler = profiler
+    # 行程池中各病房的進度訊息會互相穿插，改由主行程在每頁完成時回報
+    quiet = contextlib.redirect_stdout(io.StringIO()) if in_subprocess else contextlib.nullcontext()
+    with quiet:
+        figures = view.build_figures()
+        InteractiveProcessMining._write_dashboard_html(figures, view.dashboard_stats(), output_path, lazy, compress,
+                                                       profiler, nav_html)
+    label = '全院' if ward is None else str(ward)
+    for record in profiler.records:
+        record['stage'] = f"{label}/{record['stage']}"
+    return ward, output_path, profiler.records
+
+
+def _safe_filename(name):
+    """病房名稱轉為可用於檔名的字串"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', str(name)).strip('_') or 'ward'
+
+
+def _ward_nav_html(paths, current):
+    """各病房儀表板頂端的切換連結 (目前頁面標為 active)"""
+    links = []
+    for ward, path in paths.items():
+        label = '全院' if ward is None else str(ward)
+        active = ' class="active"' if ward == current else ''
+        links.append(f'<a href="{html.escape(os.path.basename(path))}"{active}>{html.escape(label)}</a>')
+    return f"""
+        <nav class="filter-bar">{''.join(links)}</nav>"""
+
+
+# 延遲載入模式：分頁第一次被點開時才取得圖表 JSON 並以 Plotly.newPlot 繪製
+LAZY_LOADER_JS = """
+    <script>
+        window.__adcFigureCallbacks = {};
+
+        // 以 file:// 直接開啟時瀏覽器會擋下 fetch，改載入同名的 .js 後備檔
+        function loadFigureScript(el) {
+            return new Promise(function(resolve, reject) {
+                window.__adcFigureCallbacks[el.dataset.key] = resolve;
+                const script = document.createElement('script');
+                script.src = el.dataset.fallback;
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
+
+        function fetchFigure(el) {
+            const src = el.dataset.src;
+            return fetch(src).then(function(res) {
+                if (!res.ok) throw new Error(res.status + ' ' + src);
+                if (src.endsWith('.gz')) {
+                    return new Response(res.body.pipeThrough(new DecompressionStream('gzip'))).json();
+                }
+                return res.json();
+            }).catch(function(e) {
+                // 查詢伺服器的圖表沒有 .js 後備檔
+                if (!el.dataset.fallback) throw e;
+                return loadFigureScript(el);
+            });
+        }
+
+        window.loadLazyFigure = function(container) {
+            const el = container.querySelector('.plotly-lazy');
+            if (!el || el.dataset.loaded) return;
+            el.dataset.loaded = '1';
+            fetchFigure(el).then(function(fig) {
+                el.innerHTML = '';
+                return Plotly.newPlot(el, fig.data, fig.layout, {responsive: true});
+            }).catch(function(e) {
+                el.innerHTML = '<p class="lazy-status">圖表載入失敗</p>';
+                console.error("Figure load failed: ", e);
+            });
+        };
+    </script>
+"""
+
+
+def _write_figure_assets(figures, output_path, compress=False, profiler=None):
+    """將每張圖表寫成獨立的 JSON 資產 (可選 gzip) 與 file:// 用的 .js 後備檔，回傳各分頁的佔位 HTML"""
+    profiler = profiler or StageProfiler()
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    asset_dir = os.path.join(output_dir, 'assets')
+    os.makedirs(asset_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(output_path))[0]
+
+    placeholders = {}
+    for key, fig in figures.items():
+        with profiler.stage(f'write_asset:{key}') as record:
+            fig_json = fig if isinstance(fig, str) else fig.to_json()
+            height = json.loads(fig_json).get('layout', {}).get('height') or 500
+            name = f'{stem}_{key}'
+            json_name = name + ('.json.gz' if compress else '.json')
+            with open(os.path.join(asset_dir, json_name), 'wb') as f:
+                data = fig_json.encode('utf-8')
+                data = gzip.compress(data, compresslevel=6) if compress else data
+                f.write(data)
+            with open(os.path.join(asset_dir, name + '.js'), 'w', encoding='utf-8') as f:
+                f.write(f'window.__adcFigureCallbacks["{key}"]({fig_json});\n')
+            record['bytes_out'] = len(data)
+        placeholders[key] = (f'<div class="plotly-lazy" data-key="{key}" data-src="assets/{json_name}" '
+                             f'data-fallback="assets/{name}.js" style="height:{height}px; width:100%;">'
+                             f'<p class="lazy-status">圖表載入中...</p></div>')
+    return placeholders
+
+
+def _write_local_plotlyjs(output_path):
+    """將 plotly 套件內附的 plotly.js 複製到 assets/，讓離線環境也能開啟儀表板"""
+    from plotly.offline import get_plotlyjs
+    asset_dir = os.path.join(os.path.dirname(os.path.abspath(output_path)), 'assets')
+    os.makedirs(asset_dir, exist_ok=True)
+    target = os.path.join(asset_dir, 'plotly.min.js')
+    script = get_plotlyjs().encode('utf-8')
+    if not os.path.exists(target) or os.path.getsize(target) != len(script):
+        with open(target, 'wb') as f:
+            f.write(script)
+    return 'assets/plotly.min.js'
+
+
 class InteractiveProcessMining:
     """互動式流程挖掘工具"""
-    
-    def __init__(self, data_path):
+
+    def __init__(self, data_path, use_cache=True, cache_dir=None, compact=False, profiler=None, start=None, end=None,
+                 case_notion='patient_day', case_gap_minutes=DEFAULT_CASE_GAP_MINUTES, timeline_cases=20,
+                 timeline_sampling='first'):
         self.data_path = data_path
+        self.profiler = profiler or StageProfiler()
+        self.start = start
+        self.end = end
+        self.case_notion = case_notion
+        self.case_gap_minutes = case_gap_minutes
+        self.timeline_cases = timeline_cases
+        self.timeline_sampling = timeline_sampling
+        self.use_cache = use_cache
+        self.compact = compact
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(data_path)), '.adc_cache')
+        self.cache_path = os.path.join(self.cache_dir, os.path.basename(data_path) + '.npz')
+        self.cube_path = os.path.join(self.cache_dir, os.path.basename(data_path) + '.cube.npz')
         self.df = None
+        self._fingerprint = None
+        self._case_engine = None
+        self._dfg = None
+        self._variants = None
+        self._waiting_times = None
+        self._cube = None
         self.load_data()
         
     def load_data(self):
-        """載入並預處理資料"""
+        """載入並預處理資料 (來源為事件庫目錄時只讀需要的分區)，再套用日期區間與案例定義"""
         print(f"從 {self.data_path} 載入資料中...")
+        if EventStore.is_store(self.data_path):
+            self._load_store()
+        else:
+            self._load_source()
+            self._restrict_dates()
+        # 快取與事件庫保存的是 病歷號 + 日期 的案例鍵，其他案例定義在載入後重算
+        if self.case_notion != 'patient_day':
+            self.set_case_notion(self.case_notion, self.case_gap_minutes)
+
+    def _load_source(self):
+        """讀取紀錄檔並衍生欄位 (優先使用以來源檔案指紋為鍵的欄式快取)"""
+        fingerprint = None
+        if self.use_cache and os.path.exists(self.data_path):
+            fingerprint = _file_fingerprint(self.data_path)
+            with self.profiler.stage('load_cache') as record:
+                cached = _load_frame_npz(self.cache_path, fingerprint)
+                record['rows_out'] = None if cached is None else len(cached)
+            if cached is not None:
+                self.df = cached
+                self._case_engine = None
+                self._dfg = None
+                self._variants = None
+                self._waiting_times = None
+                self._cube = None
+                self._fingerprint = fingerprint
+                print(f"已從快取 {self.cache_path} 載入！共 {len(self.df)} 筆記錄")
+                return
+
         try:
-            self.df = pd.read_excel(self.data_path)
+            with self.profiler.stage('read_source') as record:
+                if _is_csv(self.data_path):
+                    self.df = pd.read_csv(self.data_path)
+                else:
+                    self.df = pd.read_excel(self.data_path)
+                record['rows_out'] = len(self.df)
         except FileNotFoundError:
             print(f"錯誤：找不到檔案！請確認 '{self.data_path}' 路徑是否正確。")
             sys.exit(1)
@@ -49,19 +1458,192 @@ class InteractiveProcessMining:
             print(f"讀取 Excel 檔案時發生未預期的錯誤: {e}")
             sys.exit(1)
             
-        self.df['紀錄時間'] = pd.to_datetime(self.df['紀錄時間'], format='mixed')
-        self.df = self.df.sort_values('紀錄時間').reset_index(drop=True)
-        self.df['日期'] = self.df['紀錄時間'].dt.date
-        self.df['案例ID'] = self.df['病歷號'].astype(str) + '_' + self.df['日期'].astype(str)
-        self.df['小時'] = self.df['紀錄時間'].dt.hour
-        self.df['星期'] = self.df['紀錄時間'].dt.day_name()
+        with self.profiler.stage('derive_columns', rows_in=len(self.df)) as record:
+            self.df = _derive_event_columns(self.df)
+            record['rows_out'] = len(self.df)
+        self._case_engine = None
+        self._dfg = None
+        self._variants = None
+        self._waiting_times = None
+        self._cube = None
+        self._fingerprint = fingerprint
         print(f"資料載入完成！共 {len(self.df)} 筆記錄")
-    
+
+        if fingerprint is not None:
+            try:
+                with self.profiler.stage('save_cache', rows_in=len(self.df)):
+                    _save_frame_npz(self.df, self.cache_path, fingerprint)
+                print(f"已寫入快取: {self.cache_path}")
+            except OSError as e:
+                print(f"寫入快取時發生錯誤 (不影響本次執行): {e}")
+
+    def _load_store(self):
+        """從事件庫載入 [start, end) 的事件"""
+        try:
+            store = EventStore(self.data_path)
+            with self.profiler.stage('load_store') as record:
+                self.df, touched = store.load(self.start, self.end)
+                record['rows_out'] = len(self.df)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"錯誤：無法讀取事件庫 {self.data_path}: {e}")
+            sys.exit(1)
+        self._case_engine = None
+        self._dfg = None
+        self._variants = None
+        self._waiting_times = None
+        self._cube = None
+        self._fingerprint = None
+        print(f"已從事件庫載入 {touched}/{len(store.partitions)} 個分區！共 {len(self.df)} 筆記錄")
+
+    def _restrict_dates(self):
+        """只保留 [start, end) 的事件 (事件表已依紀錄時間排序)；快取仍保存完整資料"""
+        if self.start is None and self.end is None:
+            return
+        times = self.df['紀錄時間'].values
+        lo = 0 if self.start is None else int(np.searchsorted(times, np.datetime64(pd.Timestamp(self.start))))
+        hi = len(times) if self.end is None else int(np.searchsorted(times, np.datetime64(pd.Timestamp(self.end))))
+        self.df = self.df.iloc[lo:hi].reset_index(drop=True)
+        # 指紋代表完整來源，篩選後不能沿用以指紋為鍵的事件立方體快取
+        self._fingerprint = None
+        print(f"日期區間篩選後共 {len(self.df)} 筆記錄")
+
+    def set_case_notion(self, notion, gap_minutes=None):
+        """切換案例定義並重算案例鍵 (不重新載入資料)；案例引擎、DFG、變體與等待時間於下次使用時依新案例重建
+
+        notion 為 CASE_NOTIONS 之一；session 模式下 gap_minutes 為切分案例的閒置分鐘數。
+        事件立方體只計算事件數，與案例定義無關，因此保留。
+        """
+        gap_minutes = self.case_gap_minutes if gap_minutes is None else gap_minutes
+        with self.profiler.stage('case_keys', rows_in=len(self.df)) as record:
+            self.df['案例ID'] = _case_keys(self.df, notion, gap_minutes)
+            record['rows_out'] = self.df['案例ID'].nunique()
+        self.case_notion = notion
+        self.case_gap_minutes = gap_minutes
+        self._case_engine = None
+        self._dfg = None
+        self._variants = None
+        self._waiting_times = None
+
+    def with_case_notion(self, notion, gap_minutes=None):
+        """回傳改用另一種案例定義的分析器 (本分析器的案例鍵不受影響；事件立方體共用)"""
+        view = object.__new__(InteractiveProcessMining)
+        view.__dict__.update(self.__dict__)
+        view.df = self.df.copy()
+        view._fingerprint = None
+        view.set_case_notion(notion, gap_minutes)
+        return view
+
+    def _get_case_engine(self):
+        """取得 (必要時建立) 共用案例引擎，供處理時間、流程網路與時間軸共用"""
+        if self._case_engine is None:
+            with self.profiler.stage('case_engine', rows_in=len(self.df)) as record:
+                self._case_engine = CaseEngine(self.df)
+                record['rows_out'] = len(self._case_engine.case_ids)
+        return self._case_engine
+
+    def get_directly_follows_graph(self, wards=None, start=None, end=None):
+        """取得直接跟隨圖，可依病房或時間區間篩選"""
+        if self._dfg is None:
+            engine = self._get_case_engine()
+            with self.profiler.stage('directly_follows_graph', rows_in=len(engine.times)) as record:
+                self._dfg = DirectlyFollowsGraph.from_case_engine(engine)
+                record['rows_out'] = len(self._dfg)
+        if wards is None and start is None and end is None:
+            return self._dfg
+        return self._dfg.filter(wards, start, end)
+
+    def get_trace_variants(self):
+        """取得 (必要時建立) 流程變體引擎"""
+        if self._variants is None:
+            engine = self._get_case_engine()
+            with self.profiler.stage('trace_variants', rows_in=len(engine.case_ids)) as record:
+                self._variants = TraceVariants(engine)
+                record['rows_out'] = len(self._variants)
+        return self._variants
+
+    def get_waiting_times(self):
+        """取得 (必要時建立) 轉換等待時間摘要，由 DFG 的轉換陣列一次分箱"""
+        if self._waiting_times is None:
+            dfg = self.get_directly_follows_graph()
+            with self.profiler.stage('waiting_times', rows_in=len(dfg)) as record:
+                self._waiting_times = WaitingTimeSketch.from_dfg(dfg)
+                record['rows_out'] = len(self._waiting_times.keys)
+        return self._waiting_times
+
+    def get_event_cube(self, wards=None, activities=None, start=None, end=None):
+        """取得 (必要時建立或從快取讀取) 事件立方體，可依病房、動作或時間區間篩選"""
+        if self._cube is None:
+            if self._fingerprint is not None:
+                self._cube = EventCube.load(self.cube_path, self._fingerprint)
+            if self._cube is None:
+                with self.profiler.stage('event_cube', rows_in=len(self.df)) as record:
+                    self._cube = EventCube.from_events(self.df)
+                    record['rows_out'] = self._cube.counts.size
+                if self._fingerprint is not None:
+                    try:
+                        self._cube.save(self.cube_path, self._fingerprint)
+                    except OSError as e:
+                        print(f"寫入立方體快取時發生錯誤 (不影響本次執行): {e}")
+        if wards is None and activities is None and start is None and end is None:
+            return self._cube
+        return self._cube.filter(wards, activities, start, end)
+
+    def filtered(self, wards=None, activities=None, start=None, end=None):
+        """回傳只含指定病房、動作與日期區間 [start, end) 事件的分析器 (共用設定，案例引擎等另行建立)"""
+        mask = np.ones(len(self.df), dtype=bool)
+        if wards is not None:
+            mask &= self.df['病房'].isin(list(wards)).values
+        if activities is not None:
+            mask &= self.df['動作'].isin(list(activities)).values
+        if start is not None:
+            mask &= (self.df['日期'] >= pd.Timestamp(start)).values
+        if end is not None:
+            mask &= (self.df['日期'] < pd.Timestamp(end)).values
+        return self._view(self.df[mask].reset_index(drop=True), self.get_event_cube(wards, activities, start, end))
+
+    def ward_views(self):
+        """依病房一次分組，回傳 {病房: 只含該病房事件的分析器}
+
+        結果與逐一呼叫 filtered(wards=[病房]) 相同，但只做一次穩定排序 (組內維持時間順序)，
+        各病房的事件為排序後的一段連續列；事件立方體也只建一次再依病房切片。
+        """
+        wards = self.df['病房'].cat.categories
+        codes = self.df['病房'].cat.codes.values
+        with self.profiler.stage('ward_groups', rows_in=len(self.df)) as record:
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(wards) + 1))
+            cube = self.get_event_cube()
+            views = {}
+            for i, ward in enumerate(wards):
+                if bounds[i] < bounds[i + 1]:
+                    rows = self.df.iloc[order[bounds[i]:bounds[i + 1]]].reset_index(drop=True)
+                    views[ward] = self._view(rows, cube.filter(wards=[ward]))
+            record['rows_out'] = len(views)
+        return views
+
+    def _view(self, df, cube):
+        """共用設定、只換掉事件表與立方體的分析器；案例引擎、DFG、變體與等待時間另行建立"""
+        view = object.__new__(InteractiveProcessMining)
+        view.__dict__.update(self.__dict__)
+        view.df = df
+        view.use_cache = False
+        view._fingerprint = None
+        view._case_engine = None
+        view._dfg = None
+        view._variants = None
+        view._waiting_times = None
+        view._cube = cube
+        return view
+
     # --- (所有的 _build_... 函數都不變，這裡省略以節省篇幅) ---
     def _build_activity_pie_chart(self):
         """1. 建立動作類型分布 (圓餅圖)"""
         print("建構 1. 動作類型分布圖...")
-        activity_counts = self.df['動作'].value_counts()
+        return self._render_activity_pie_chart(self.get_event_cube().activity_counts())
+
+    @staticmethod
+    def _render_activity_pie_chart(activity_counts):
+        """依動作計數繪製圓餅圖"""
         fig = go.Figure(data=[go.Pie(
             labels=activity_counts.index,
             values=activity_counts.values,
@@ -75,7 +1657,12 @@ class InteractiveProcessMining:
     def _build_ward_bar_chart(self):
         """2. 建立病房活動量排名 (長條圖)"""
         print("建構 2. 病房活動量排名圖...")
-        ward_counts = self.df['病房'].value_counts().sort_values(ascending=True)
+        return self._render_ward_bar_chart(self.get_event_cube().ward_counts())
+
+    @staticmethod
+    def _render_ward_bar_chart(ward_counts):
+        """依病房計數繪製橫向長條圖"""
+        ward_counts = ward_counts.sort_values(ascending=True)
         fig = go.Figure(data=[go.Bar(
             x=ward_counts.values,
             y=ward_counts.index,
@@ -91,15 +1678,16 @@ class InteractiveProcessMining:
     def _build_duration_violin_plot(self):
         """3. 建立處理時間分布 (小提琴圖)"""
         print("建構 3. 處理時間分布圖...")
-        case_times = []
-        for case_id in self.df['案例ID'].unique():
-            case_data = self.df[self.df['案例ID'] == case_id].sort_values('紀錄時間')
-            if len(case_data) >= 2:
-                duration = (case_data['紀錄時間'].iloc[-1] - case_data['紀錄時間'].iloc[0]).total_seconds() / 60
-                if 0 < duration < 1000:
-                    case_times.append({'病房': case_data['病房'].iloc[0], '處理時間(分鐘)': duration})
-        
-        case_df = pd.DataFrame(case_times)
+        cases = self._get_case_engine().cases
+        duration = cases['處理時間(分鐘)']
+        case_df = cases.loc[(cases['事件數'] >= 2) & (duration > 0) & (duration < 1000), ['病房', '處理時間(分鐘)']]
+        return self._render_duration_violin_plot(case_df, self.compact)
+
+    @staticmethod
+    def _render_duration_violin_plot(case_df, compact=False):
+        """依各案例 (病房, 處理時間) 繪製小提琴圖；compact 時改送伺服器端算好的摘要"""
+        if compact:
+            return InteractiveProcessMining._render_duration_violin_compact(case_df)
         fig = go.Figure()
         if not case_df.empty:
             for ward in case_df['病房'].unique():
@@ -111,12 +1699,48 @@ class InteractiveProcessMining:
             fig.update_layout(title_text="<b>各病房案例處理時間分布</b>")
         return fig
 
+    @staticmethod
+    def _render_duration_violin_compact(case_df):
+        """精簡小提琴圖：每個病房只送出固定解析度的密度輪廓與箱形圖統計，大小與案例數無關"""
+        fig = go.Figure()
+        if case_df.empty:
+            fig.add_annotation(text="無資料產生處理時間分布圖", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=16))
+            fig.update_layout(title_text="<b>各病房案例處理時間分布</b>")
+            return fig
+
+        colors = px.colors.qualitative.Plotly
+        wards = case_df['病房'].unique()
+        rng = np.random.default_rng(0)
+        for i, ward in enumerate(wards):
+            stats = _summarize_distribution(case_df.loc[case_df['病房'] == ward, '處理時間(分鐘)'].values, rng=rng)
+            color = colors[i % len(colors)]
+            half_width = 0.45 * stats['density'] / stats['density'].max()
+            fig.add_trace(go.Scatter(
+                x=np.concatenate([i - half_width, (i + half_width)[::-1]]),
+                y=np.concatenate([stats['grid'], stats['grid'][::-1]]),
+                fill='toself', mode='lines', line=dict(color=color, width=1), opacity=0.6,
+                name=str(ward), legendgroup=str(ward), hoverinfo='skip'))
+            fig.add_trace(go.Box(
+                x=[i], q1=[stats['q1']], median=[stats['median']], q3=[stats['q3']], mean=[stats['mean']],
+                lowerfence=[stats['lowerfence']], upperfence=[stats['upperfence']],
+                width=0.1, boxmean=True, marker_color=color, name=str(ward), legendgroup=str(ward), showlegend=False,
+                hovertemplate=f"<b>{ward}</b> (n={stats['count']:,})<br>"
+                              f"中位數: {stats['median']:.1f} 分鐘<br>Q1~Q3: {stats['q1']:.1f} ~ {stats['q3']:.1f} 分鐘<br>"
+                              f"平均: {stats['mean']:.1f} 分鐘<extra></extra>"))
+        fig.update_layout(title_text="<b>各病房案例處理時間分布</b>", title_font_size=20, height=600, yaxis_title="處理時間 (分鐘)", showlegend=True,
+                          xaxis=dict(tickmode='array', tickvals=list(range(len(wards))), ticktext=[str(w) for w in wards], showgrid=False))
+        return fig
+
     def _build_daily_trend_scatter(self):
         """4. 建立每日活動趨勢 (折線圖)"""
         print("建構 4. 每日活動趨勢圖...")
-        daily_counts = self.df.groupby('日期').size().reset_index(name='count')
+        return self._render_daily_trend_scatter(self.get_event_cube().daily_counts())
+
+    @staticmethod
+    def _render_daily_trend_scatter(daily_counts):
+        """依每日計數 (以日期為索引) 繪製趨勢圖"""
         fig = go.Figure(data=[go.Scatter(
-            x=daily_counts['日期'], y=daily_counts['count'], mode='lines+markers', line=dict(color='royalblue', width=2),
+            x=daily_counts.index, y=daily_counts.values, mode='lines+markers', line=dict(color='royalblue', width=2),
             marker=dict(size=6), fill='tozeroy', fillcolor='rgba(65, 105, 225, 0.2)', hovertemplate='日期: %{x}<br>活動數: %{y}<extra></extra>'
         )])
         fig.update_layout(title_text="<b>每日活動趨勢</b>", title_font_size=20, height=500, xaxis_title="日期", yaxis_title="活動數量", hovermode='x unified')
@@ -125,20 +1749,16 @@ class InteractiveProcessMining:
     def _build_process_flow_network(self):
         """5. 建立流程網路圖 (Sankey)"""
         print("建構 5. 流程轉換網路圖...")
-        transitions = []
-        for case_id in self.df['案例ID'].unique():
-            case_data = self.df[self.df['案例ID'] == case_id].sort_values('紀錄時間')
-            activities = case_data['動作'].tolist()
-            for i in range(len(activities) - 1):
-                transitions.append({'source': activities[i], 'target': activities[i+1]})
-        
-        trans_df = pd.DataFrame(transitions)
+        return self._render_process_flow_network(self.get_directly_follows_graph().top_edges(20))
+
+    @staticmethod
+    def _render_process_flow_network(trans_counts):
+        """依轉換計數 (source, target, value) 繪製 Top 20 Sankey 圖"""
         fig = go.Figure()
-        if trans_df.empty:
+        if trans_counts.empty:
             fig.add_annotation(text="無資料可產生流程網路圖", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=16))
         else:
-            trans_counts = trans_df.groupby(['source', 'target']).size().reset_index(name='value')
-            trans_counts = trans_counts.sort_values('value', ascending=False).head(20)
+            trans_counts = trans_counts.sort_values('value', ascending=False, kind='stable').head(20)
             all_nodes = list(set(trans_counts['source'].unique()) | set(trans_counts['target'].unique()))
             node_dict = {node: idx for idx, node in enumerate(all_nodes)}
             node_colors = ['#%02x%02x%02x' % (np.random.randint(100, 255), np.random.randint(100, 255), np.random.randint(100, 255)) for _ in all_nodes]
@@ -150,23 +1770,92 @@ class InteractiveProcessMining:
             ))
         fig.update_layout(title="<b>ADC系統流程轉換網路圖 (Top 20)</b>", title_font_size=20, font=dict(size=14), height=700)
         return fig
-    
+    
+    def _build_variant_chart(self):
+        """8. 建立流程變體分析 (長條圖 + 累積涵蓋率)"""
+        print("建構 8. 流程變體分析...")
+        return self._render_variant_chart(self.get_trace_variants().overview(20))
+
+    @staticmethod
+    def _render_variant_chart(variants):
+        """依前幾名變體 (路徑、案例數、累積佔比、處理時間) 繪製長條圖與累積涵蓋率折線"""
+        top = variants['top']
+        fig = plotly_subplots.make_subplots(specs=[[{'secondary_y': True}]])
+        if top.empty:
+            fig.add_annotation(text="無資料可產生流程變體分析", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=16))
+            fig.update_layout(title_text="<b>流程變體分析</b>")
+            return fig
+
+        def minutes(value):
+            return '-' if pd.isna(value) else f'{value:.1f} 分鐘'
+
+        labels = [f'V{i + 1}' for i in range(len(top))]
+        hover = [f"<b>{label}</b> ({row['事件數']} 個動作)<br>{row['路徑']}<br>"
+                 f"案例數: {row['案例數']:,} ({row['佔比']:.1%})<br>"
+                 f"處理時間 平均 {minutes(row['平均處理時間(分鐘)'])} / 中位數 {minutes(row['中位數處理時間(分鐘)'])} / "
+                 f"P90 {minutes(row['P90處理時間(分鐘)'])}"
+                 for label, (_, row) in zip(labels, top.iterrows())]
+        fig.add_trace(go.Bar(x=labels, y=top['案例數'], name='案例數', marker_color='steelblue',
+                             hovertext=hover, hovertemplate='%{hovertext}<extra></extra>'), secondary_y=False)
+        fig.add_trace(go.Scatter(x=labels, y=top['累積佔比'] * 100, name='累積涵蓋率', mode='lines+markers',
+                                 line=dict(color='darkorange', width=2), hovertemplate='前 %{x}: %{y:.1f}% 案例<extra></extra>'),
+                      secondary_y=True)
+
+        coverage = ' / '.join(f'{share:.0%} 案例需 {n:,} 個' for share, n in variants['coverage'].items())
+        fig.update_layout(title_text=f"<b>流程變體分析 (前 {len(top)} 名)</b><br><sup>共 {variants['num_variants']:,} 個變體、"
+                                     f"{variants['num_cases']:,} 個案例；前 {len(top)} 名涵蓋 {top['累積佔比'].iloc[-1]:.1%}；{coverage}</sup>",
+                          title_font_size=20, height=600, xaxis_title="變體 (依案例數排序，懸停查看路徑)", hovermode='closest',
+                          legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+        fig.update_yaxes(title_text="案例數", secondary_y=False)
+        fig.update_yaxes(title_text="累積涵蓋率 (%)", range=[0, 105], secondary_y=True)
+        return fig
+
+    def _build_bottleneck_chart(self):
+        """9. 建立轉換等待時間瓶頸排名 (長條圖)"""
+        print("建構 9. 轉換瓶頸分析...")
+        waiting_times = self.get_waiting_times()
+        return self._render_bottleneck_chart(waiting_times.top(20), len(waiting_times))
+
+    @staticmethod
+    def _render_bottleneck_chart(table, num_transitions):
+        """依 P90 排名的轉換 (來源、目標、病房、次數、平均與 P50/P90/P99) 繪製分組橫條圖"""
+        fig = go.Figure()
+        if table.empty:
+            fig.add_annotation(text=f"沒有次數達 {BOTTLENECK_MIN_COUNT} 次的轉換可排名", xref="paper", yref="paper",
+                               x=0.5, y=0.5, showarrow=False, font=dict(size=16))
+            fig.update_layout(title_text="<b>轉換瓶頸分析</b>")
+            return fig
+
+        labels = [f'{source} → {target} ({ward})' for source, target, ward in zip(table['source'], table['target'], table['病房'])]
+        customdata = np.column_stack([table['次數'], table['平均(分鐘)']])
+        for q, color in zip(BOTTLENECK_QUANTILES, ['lightskyblue', 'royalblue', 'crimson']):
+            column = f'P{q * 100:g}(分鐘)'
+            fig.add_trace(go.Bar(
+                y=labels, x=table[column], orientation='h', name=f'P{q * 100:g}', marker_color=color, customdata=customdata,
+                hovertemplate=f'<b>%{{y}}</b><br>P{q * 100:g}: %{{x:.1f}} 分鐘<br>次數: %{{customdata[0]:,}}<br>'
+                              f'平均: %{{customdata[1]:.1f}} 分鐘<extra></extra>'))
+        fig.update_layout(title_text=f"<b>轉換等待時間瓶頸 (依 P90 排序，前 {len(table)} 名)</b><br><sup>共 {num_transitions:,} 次轉換；"
+                                     f"只納入次數達 {BOTTLENECK_MIN_COUNT} 次的 (來源動作 → 目標動作, 病房)</sup>",
+                          title_font_size=20, height=700, barmode='group', xaxis_title="等待時間 (分鐘)",
+                          legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1))
+        fig.update_yaxes(autorange="reversed")
+        return fig
+
     def _build_performance_heatmap(self):
         """6. 建立效能熱力圖 (Heatmap)"""
         print("建構 6. 效能熱力圖...")
-        self.df['星期幾'] = self.df['紀錄時間'].dt.dayofweek
-        self.df['星期名稱'] = self.df['紀錄時間'].dt.day_name()
-        hourly_weekly = self.df.groupby(['星期名稱', '星期幾', '小時']).size().reset_index(name='活動數')
-        week_order = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+        return self._render_performance_heatmap(self.get_event_cube().hour_weekday())
+
+    @staticmethod
+    def _render_performance_heatmap(hour_weekday):
+        """依 7x24 (星期一..星期日 x 0..23 時) 計數矩陣繪製熱力圖"""
         week_order_zh = ['星期一', '星期二', '星期三', '星期四', '星期五', '星期六', '星期日']
-        pivot_table = hourly_weekly.pivot_table(index='星期名稱', columns='小時', values='活動數', fill_value=0)
-        for h in range(24):
-            if h not in pivot_table.columns: pivot_table[h] = 0
-        pivot_table = pivot_table.reindex(week_order)
-        pivot_table = pivot_table.sort_index(axis=1)
-        
+        z = np.asarray(hour_weekday, dtype=float)
+        # 沒有任何資料的星期以空白呈現 (與原本 reindex 後的 NaN 一致)
+        z[z.sum(axis=1) == 0] = np.nan
+
         fig = go.Figure(data=go.Heatmap(
-            z=pivot_table.values, x=[f'{h:02d}:00' for h in pivot_table.columns], y=[week_order_zh[week_order.index(d)] for d in pivot_table.index],
+            z=z, x=[f'{h:02d}:00' for h in range(24)], y=week_order_zh,
             colorscale='YlOrRd', hovertemplate='時段: %{x}<br>星期: %{y}<br>活動數: %{z}<extra></extra>', colorbar=dict(title='活動數')
         ))
         fig.update_layout(title='<b>系統使用熱力圖 (按星期與時段)</b>', title_font_size=20, xaxis_title='時段 (24小時制)',
@@ -176,74 +1865,245 @@ class InteractiveProcessMining:
     def _build_activity_timeline(self):
         """7. 建立活動時間軸 (Gantt)"""
         print("建構 7. 活動時間軸...")
-        unique_cases = self.df['案例ID'].unique()
-        sample_cases = unique_cases[:20]
-        timeline_data = []
-        for idx, case_id in enumerate(sample_cases):
-            case_data = self.df[self.df['案例ID'] == case_id].sort_values('紀錄時間')
-            if len(case_data) > 0:
-                for i in range(len(case_data)):
-                    row = case_data.iloc[i]
-                    start_time = row['紀錄時間']
-                    end_time = case_data.iloc[i+1]['紀錄時間'] if i < len(case_data) - 1 else start_time + pd.Timedelta(minutes=1)
-                    timeline_data.append({'Case': f'案例 {idx+1} ({case_id.split("_")[0][-4:]})', 'Activity': row['動作'],
-                                         'Start': start_time, 'Finish': end_time, 'Ward': row['病房']})
-        
+        timeline_df = self._timeline_events(self._get_case_engine(), self.df['病歷號'].cat.categories,
+                                            self.timeline_cases, self.timeline_sampling)
+        # 案例數不足或抽樣條件篩掉部分案例時，標題顯示實際抽出的案例數
+        title = TIMELINE_SAMPLING_LABELS[self.timeline_sampling].format(n=timeline_df['Case'].nunique())
+        return self._render_activity_timeline(timeline_df, self.compact, title)
+
+    @staticmethod
+    def _timeline_events(engine, patients, n_cases=20, sampling='first', rng=None):
+        """取抽樣案例的事件區段 (每個事件結束於同案例下一事件，最後一筆延長 1 分鐘)；patients 為病歷號對照表"""
+        cases = _sample_timeline_cases(engine, n_cases, sampling, rng)
+        # 各案例在排序後陣列中是連續的一段，依顯示順序串接這些區段的列位置
+        sizes = engine.sizes[cases]
+        stop = int(sizes.sum())
+        offsets = np.cumsum(sizes) - sizes
+        rows = np.repeat(engine.starts[cases] - offsets, sizes) + np.arange(stop)
+        events = engine.sorted.iloc[rows]
+        row_case = np.repeat(np.arange(len(cases)), sizes)
+
+        timeline_df = pd.DataFrame(columns=['Case', 'Activity', 'Start', 'Finish', 'Ward'])
+        if not events.empty:
+            start_times = events['紀錄時間'].values
+            finish_times = start_times + np.timedelta64(1, 'm')
+            is_last = np.zeros(stop, dtype=bool)
+            is_last[offsets + sizes - 1] = True
+            finish_times[~is_last] = start_times[1:][~is_last[:-1]]
+            patient_values, _ = _decode_case_keys(engine.case_ids[cases], patients)
+            case_labels = np.array([f'案例 {idx+1} ({str(patient)[-4:]})' for idx, patient in enumerate(patient_values)])
+            timeline_df = pd.DataFrame({'Case': case_labels[row_case], 'Activity': np.asarray(events['動作'], dtype=object),
+                                        'Start': start_times, 'Finish': finish_times, 'Ward': np.asarray(events['病房'], dtype=object)})
+        return timeline_df
+
+    @staticmethod
+    def _render_activity_timeline(timeline_df, compact=False, title='前20個案例'):
+        """依事件區段 (Case, Activity, Start, Finish, Ward) 繪製甘特圖；compact 時先合併連續的相同動作
+
+        長條數超過 TIMELINE_WEBGL_MIN_BARS 時改以 WebGL (Scattergl) 繪製，數千個案例仍可流暢縮放。
+        """
         fig = go.Figure()
-        if not timeline_data:
+        if compact and not timeline_df.empty:
+            timeline_df = _merge_timeline_runs(timeline_df)
+        hover_data = ['Ward', 'Start', 'Finish', 'Events'] if compact else ['Ward', 'Start', 'Finish']
+        n_cases = timeline_df['Case'].nunique()
+        height = 700
+        if timeline_df.empty:
             fig.add_annotation(text="無資料可產生時間軸", xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=16))
+        elif len(timeline_df) >= TIMELINE_WEBGL_MIN_BARS:
+            fig = go.Figure(_timeline_gl_traces(timeline_df))
+            height = int(min(max(700, n_cases * 6), 4000))
+            line_width = max(1.0, min(12.0, (height - 150) / n_cases * 0.7))
+            fig.update_traces(line=dict(width=line_width))
+            # 案例多時只留格線，案例名稱改由滑鼠提示顯示
+            fig.update_yaxes(type='category', categoryorder='array', categoryarray=list(pd.unique(timeline_df['Case'])),
+                             autorange="reversed", showticklabels=n_cases <= 100)
         else:
-            timeline_df = pd.DataFrame(timeline_data)
-            fig = px.timeline(timeline_df, x_start='Start', x_end='Finish', y='Case', color='Activity', hover_data=['Ward', 'Start', 'Finish'])
+            fig = px.timeline(timeline_df, x_start='Start', x_end='Finish', y='Case', color='Activity', hover_data=hover_data)
             fig.update_yaxes(autorange="reversed")
         
-        fig.update_layout(title='<b>前20個案例的活動時間軸 (抽樣)</b>', title_font_size=20, xaxis_title='時間',
-                          yaxis_title='案例', height=700, showlegend=True)
+        fig.update_layout(title=f'<b>{title}的活動時間軸 (抽樣)</b>', title_font_size=20, xaxis_title='時間',
+                          yaxis_title='案例', height=height, showlegend=True)
         return fig
     
-    def generate_interactive_tabbed_dashboard(self):
-        """建立主HTML頁面 (互動式分頁)"""
+    def generate_interactive_tabbed_dashboard(self, output_path='index.html', workers=1, lazy=False, compress=False):
+        """建立主HTML頁面 (互動式分頁)；workers > 1 時平行建構圖表，lazy 時各圖表另存為延遲載入的資產"""
         print("\n開始生成互動式分頁儀表板...")
         
         # 1. 獲取所有圖表物件
-        fig_pie = self._build_activity_pie_chart()
-        fig_bar = self._build_ward_bar_chart()
-        fig_sankey = self._build_process_flow_network()
-        fig_timeline = self._build_activity_timeline()
-        fig_heatmap = self._build_performance_heatmap()
-        fig_violin = self._build_duration_violin_plot()
-        fig_trend = self._build_daily_trend_scatter()
-        
-        print("\n所有圖表物件已在記憶體中生成。")
-        print("正在將圖表轉換為 HTML 程式碼片段...")
+        if workers > 1:
+            figures = self._build_fragments_parallel(workers, lazy)
+            print(f"\n所有圖表已由 {workers} 個工作者平行生成並轉換為 HTML。")
+        else:
+            figures = self.build_figures()
+            print("\n所有圖表物件已在記憶體中生成。")
 
-        # 2. 將圖表轉換為 HTML (div 區塊)
-        #    include_plotlyjs=False 確保 JS 不會被重複加載
-        #    config={'responsive': True} 嘗試讓圖表自適應
-        config_responsive = {'responsive': True}
-        
-        pie_html = fig_pie.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        bar_html = fig_bar.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        sankey_html = fig_sankey.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        timeline_html = fig_timeline.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        heatmap_html = fig_heatmap.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        violin_html = fig_violin.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
-        trend_html = fig_trend.to_html(full_html=False, include_plotlyjs=False, config=config_responsive)
+        self._write_dashboard_html(figures, self.dashboard_stats(), output_path, lazy, compress, self.profiler)
+
+    def build_figures(self):
+        """依序建構所有分頁圖表，每個 _build_* 各記錄為一個階段"""
+        figures = {}
+        for key, method in DASHBOARD_BUILDERS:
+            with self.profiler.stage(method, rows_in=len(self.df)) as record:
+                figures[key] = getattr(self, method)()
+            record['rows_out'] = _figure_rows(figures[key])
+        return figures
+
+    def dashboard_stats(self):
+        """儀表板頁首的統計數字"""
+        return {
+            'total_records': len(self.df),
+            'num_wards': self.df['病房'].nunique(),
+            'num_activities': self.df['動作'].nunique(),
+            'num_cases': self.df['案例ID'].nunique(),
+        }
+
+    def _build_fragments_parallel(self, workers, lazy=False):
+        """以多個工作者同時建構圖表並轉換為 HTML 片段
+
+        支援 fork 的平台使用行程池：工作者經由 fork 繼承已準備好的 self.df 與案例引擎
+        (寫入時才複製)，不需序列化整份資料；其他平台改用執行緒池共用同一份資料。
+        """
+        global _PARALLEL_TOOL
+        # 先在主行程建立共用的案例引擎、DFG、變體、等待時間摘要與事件立方體，避免每個工作者各自重算
+        self.get_directly_follows_graph()
+        self.get_trace_variants()
+        self.get_waiting_times()
+        self.get_event_cube()
+        _PARALLEL_TOOL = self
+        try:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                _import_plotly()
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            else:
+                print("此平台不支援 fork，改用執行緒平行建構圖表")
+                executor = ThreadPoolExecutor(max_workers=workers)
+            with executor:
+                futures = [executor.submit(_build_fragment_in_worker, key, method, lazy) for key, method in DASHBOARD_BUILDERS]
+                fragments = {}
+                for future in futures:
+                    key, fragment, records = future.result()
+                    fragments[key] = fragment
+                    self.profiler.extend(records)
+                return fragments
+        finally:
+            _PARALLEL_TOOL = None
 
+    def generate_ward_dashboards(self, output_path='index.html', workers=1, lazy=False, compress=False):
+        """全院與各病房的儀表板：資料只載入一次，依病房一次分組後由多個工作者平行建構並寫出
+
+        全院頁面寫到 output_path，各病房寫到同目錄的 <檔名>_<病房>.html (例如 index_9C.html)，
+        每頁頂端有切換病房的連結。回傳 {病房 (全院為 None): 輸出路徑}。
+        """
+        global _PARALLEL_WARD_VIEWS
+        print("\n開始生成全院與各病房的儀表板...")
+        wards = self.ward_views()
+        views = {None: self._view(self.df, self.get_event_cube())}
+        views.update((ward, wards[ward]) for ward in sorted(wards, key=str))
+        stem, ext = os.path.splitext(output_path)
+        paths = {ward: output_path if ward is None else f'{stem}_{_safe_filename(ward)}{ext or ".html"}' for ward in views}
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        # 事件多的頁面先開始，讓各工作者的負載較平均
+        jobs = sorted(views, key=lambda ward: -len(views[ward].df))
+
+        _PARALLEL_WARD_VIEWS = views
+        try:
+            if workers <= 1:
+                executor = ThreadPoolExecutor(max_workers=1)
+            elif 'fork' in multiprocessing.get_all_start_methods():
+                _import_plotly()
+                executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            else:
+                print("此平台不支援 fork，改用執行緒平行建構儀表板")
+                executor = ThreadPoolExecutor(max_workers=workers)
+            with executor:
+                futures = [executor.submit(_write_ward_dashboard_in_worker, ward, paths[ward], lazy, compress,
+                                           _ward_nav_html(paths, ward)) for ward in jobs]
+                for done, future in enumerate(as_completed(futures), 1):
+                    ward, path, records = future.result()
+                    self.profiler.extend(records)
+                    print(f"[{done}/{len(jobs)}] {'全院' if ward is None else ward} 儀表板已寫入 {path}")
+        finally:
+            _PARALLEL_WARD_VIEWS = None
+        return paths
+
+    @staticmethod
+    def _write_dashboard_html(figures, stats, output_path='index.html', lazy=False, compress=False, profiler=None,
+                              controls_html=''):
+        """將各分頁圖表與統計數據組合成分頁式 HTML
+
+        一般模式：圖表 (Figure 或已轉好的 HTML 片段) 全部內嵌在頁面中，plotly.js 由 CDN 載入。
+        lazy 模式：圖表 (Figure 或 JSON 字串) 各自寫成 assets/ 下的資產，分頁首次開啟時才載入；
+        plotly.js 也改用本機檔案，可在無網路的環境使用。
+        """
+        profiler = profiler or StageProfiler()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        except OSError as e:
+            print(f"錯誤：無法建立輸出目錄 {os.path.dirname(os.path.abspath(output_path))}: {e}")
+            sys.exit(1)
+        if lazy:
+            print("正在將圖表寫成延遲載入的 JSON 資產...")
+            fragments = _write_figure_assets(figures, output_path, compress, profiler)
+            plotly_src = _write_local_plotlyjs(output_path)
+            lazy_script = LAZY_LOADER_JS
+        else:
+            print("正在將圖表轉換為 HTML 程式碼片段...")
+            # 2. 將圖表轉換為 HTML (div 區塊)
+            fragments = {}
+            for key, fig in figures.items():
+                if isinstance(fig, str):
+                    fragments[key] = fig
+                    continue
+                with profiler.stage(f'to_html:{key}', rows_in=_figure_rows(fig)) as record:
+                    fragments[key] = _figure_to_fragment(fig)
+                    record['bytes_out'] = len(fragments[key])
+            plotly_src = 'https://cdn.plot.ly/plotly-latest.min.js'
+            lazy_script = ''
         print("HTML 程式碼片段轉換完畢。")
+        print("正在組合最終的 index.html...")
+        html_content = InteractiveProcessMining._render_dashboard_page(fragments, stats, plotly_src, lazy_script, controls_html)
+        
+        # 5. 寫入單一的 index.html 檔案
+        try:
+            with profiler.stage('write_html') as record:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(html_content)
+                record['bytes_out'] = len(html_content.encode('utf-8'))
+            print("\n============================================================")
+            print(f"成功！ 互動式分頁儀表板已生成: {output_path}")
+            print("(v6: 已修正空白圖表問題)")
+            print("============================================================")
+        except Exception as e:
+            # 排程執行時不能在沒有寫出儀表板的情況下回報成功
+            print(f"寫入 {output_path} 時發生錯誤: {e}")
+            sys.exit(1)
+
 
-        # 3. 獲取統計數據
-        total_records = len(self.df)
-        num_wards = self.df['病房'].nunique()
-        num_activities = self.df['動作'].nunique()
-        num_cases = self.df['案例ID'].nunique()
+    @staticmethod
+    def _render_dashboard_page(fragments, stats, plotly_src, lazy_script='', controls_html=''):
+        """以各分頁的圖表片段與統計數據組合分頁式 HTML 頁面；controls_html 為頁首下方的篩選列 (查詢伺服器使用)"""
+        pie_html = fragments['pie']
+        bar_html = fragments['bar']
+        sankey_html = fragments['sankey']
+        variants_html = fragments['variants']
+        bottleneck_html = fragments['bottleneck']
+        timeline_html = fragments['timeline']
+        heatmap_html = fragments['heatmap']
+        violin_html = fragments['violin']
+        trend_html = fragments['trend']
+
+        # 獲取統計數據
+        total_records = stats['total_records']
+        num_wards = stats['num_wards']
+        num_activities = stats['num_activities']
+        num_cases = stats['num_cases']
         
         total_records_str = f"{total_records:,}"
         num_cases_str = f"{num_cases:,}"
-        
-        print("正在組合最終的 index.html...")
 
-        # 4. 組合最終的 HTML 內容
+
+        # 組合最終的 HTML 內容
         #    *** 唯一的變動在最下方的 <script> 區塊 ***
         html_content = f"""
 <!DOCTYPE html>
@@ -252,7 +2112,7 @@ class InteractiveProcessMining:
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>ADC系統流程挖掘儀表板</title>
-    <script src="https://cdn.plot.ly/plotly-latest.min.js"></script>
+    <script src="{plotly_src}"></script>
     <style>
         body {{
             font-family: 'Microsoft JhengHei', 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
@@ -378,6 +2238,42 @@ class InteractiveProcessMining:
             overflow: hidden; /* 確保 Plotly 圖表自適應寬度 */
         }}
         
+        .filter-bar {{
+            display: flex;
+            flex-wrap: wrap;
+            align-items: flex-end;
+            gap: 15px;
+            background: #ffffff;
+            padding: 20px 25px;
+            border-radius: 10px;
+            box-shadow: 0 4px 10px rgba(0,0,0,0.05);
+            margin-bottom: 30px;
+        }}
+        .filter-bar label {{
+            display: flex;
+            flex-direction: column;
+            gap: 5px;
+            font-weight: bold;
+            color: #495057;
+        }}
+        .filter-bar select {{ min-width: 160px; }}
+        .filter-bar button, .filter-bar a {{
+            padding: 8px 16px;
+            border-radius: 8px;
+            border: none;
+            background-color: #3f51b5;
+            color: white;
+            text-decoration: none;
+            cursor: pointer;
+        }}
+        .filter-bar a.active {{ background-color: #ff7f50; }}
+        
+        .lazy-status {{
+            text-align: center;
+            color: #6c757d;
+            padding-top: 100px;
+        }}
+        
         footer {{
             text-align: center;
             color: #555;
@@ -392,6 +2288,7 @@ class InteractiveProcessMining:
             <h1>ADC系統流程挖掘儀表板</h1>
             <p class="subtitle">互動式資料探索分析 - 完整版</p>
         </header>
+{controls_html}
         
         <div class="info-box">
             <h3>💡 使用說明</h3>
@@ -417,6 +2314,8 @@ class InteractiveProcessMining:
             <button class="tab-button" data-target="chart-heatmap">系統使用熱力圖</button>
             <button class="tab-button" data-target="chart-trend">每日活動趨勢</button>
             <button class="tab-button" data-target="chart-sankey">流程轉換網路</button>
+            <button class="tab-button" data-target="chart-variants">流程變體</button>
+            <button class="tab-button" data-target="chart-bottleneck">轉換瓶頸</button>
             <button class="tab-button" data-target="chart-violin">案例處理時間</button>
             <button class="tab-button" data-target="chart-timeline">活動時間軸</button>
         </div>
@@ -442,6 +2341,14 @@ class InteractiveProcessMining:
                 <div class="chart-container">{sankey_html}</div>
             </div>
             
+            <div id="chart-variants" class="chart-content">
+                <div class="chart-container">{variants_html}</div>
+            </div>
+            
+            <div id="chart-bottleneck" class="chart-content">
+                <div class="chart-container">{bottleneck_html}</div>
+            </div>
+            
             <div id="chart-violin" class="chart-content">
                 <div class="chart-container">{violin_html}</div>
             </div>
@@ -456,7 +2363,7 @@ class InteractiveProcessMining:
             <p>&copy; 2025 Process Mining Demo</p>
         </footer>
     </div>
-
+{lazy_script}
     <script>
         document.addEventListener('DOMContentLoaded', function() {{
             const buttons = document.querySelectorAll('.tab-button');
@@ -468,6 +2375,7 @@ class InteractiveProcessMining:
             }}
             if (charts.length > 0) {{
                 charts[0].classList.add('active');
+                if (window.loadLazyFigure) loadLazyFigure(charts[0]);
             }}
 
             buttons.forEach(function(button) {{
@@ -492,6 +2400,9 @@ class InteractiveProcessMining:
                         // 延遲 10 毫秒，確保 div 的 'display: block' 屬性
                         // 已經被瀏覽器渲染，使其獲得實際的寬高。
                         setTimeout(function() {{
+                            // 延遲載入模式：第一次開啟此分頁時才取得並繪製圖表
+                            if (window.loadLazyFigure) loadLazyFigure(targetChartDiv);
+
                             // 找到這個 div 內的 plotly 圖表元素 (class .plotly-graph-div 是 plotly 自動生成的)
                             const plotlyElement = targetChartDiv.querySelector('.plotly-graph-div');
                             
@@ -513,35 +2424,1248 @@ class InteractiveProcessMining:
     </body>
 </html>
 """
-        
-        # 5. 寫入單一的 index.html 檔案
+        return html_content
+
+
+def _iter_raw_chunks(path, chunksize=100_000):
+    """以固定列數分批讀取原始事件 (CSV 用 pandas chunksize，Excel 用 openpyxl 唯讀模式)"""
+    if _is_csv(path):
+        for chunk in pd.read_csv(path, chunksize=chunksize, usecols=EVENT_COLUMNS):
+            yield chunk
+        return
+
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c) for c in header]
+        keep = [columns.index(c) for c in EVENT_COLUMNS]
+        batch = []
+        for row in rows:
+            batch.append([row[i] for i in keep])
+            if len(batch) >= chunksize:
+                yield pd.DataFrame(batch, columns=EVENT_COLUMNS)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=EVENT_COLUMNS)
+    finally:
+        workbook.close()
+
+
+CSV_BLOCK_BYTES = 16 << 20
+# 檔案結尾沒有換行的最後一列：檔案大小在這段時間內不變才視為已寫完
+CSV_SETTLE_SECONDS = 1.0
+
+
+def _csv_tail_digest(path, offset, size=4096):
+    """讀取位移之前最後 size 個位元組的雜湊，用來確認 CSV 只是被附加而非改寫"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, offset - size))
+        return hashlib.sha1(f.read(offset - max(0, offset - size))).hexdigest()
+
+
+def _iter_csv_from_offset(path, source, chunksize=100_000):
+    """從 source['offset'] 位元組處讀取 CSV 新增的完整列，讀完一段即更新位移
+
+    結尾沒有換行的最後一列，若檔案大小在 CSV_SETTLE_SECONDS 內不再變動即視為完整列讀入；
+    否則 (仍在寫入) 留待下次更新。
+    """
+    with open(path, 'rb') as f:
+        header = f.readline()
+        position = max(source.get('offset', 0), len(header))
+        f.seek(position)
+        pending = b''
+        while True:
+            block = f.read(CSV_BLOCK_BYTES)
+            if not block:
+                if pending.strip() and _csv_size_settled(f, position + len(pending)):
+                    yield from pd.read_csv(io.BytesIO(header + pending), chunksize=chunksize, usecols=EVENT_COLUMNS)
+                    source['offset'] = position + len(pending)
+                break
+            data = pending + block
+            cut = data.rfind(b'\n') + 1
+            pending = data[cut:]
+            if cut == 0:
+                continue
+            # 尚未寫完的最後一列留待下次更新
+            for chunk in pd.read_csv(io.BytesIO(header + data[:cut]), chunksize=chunksize, usecols=EVENT_COLUMNS):
+                yield chunk
+            position += cut
+            source['offset'] = position
+
+
+def _csv_size_settled(f, size):
+    """檔案大小為 size，且等待 CSV_SETTLE_SECONDS 後仍未變動"""
+    if os.fstat(f.fileno()).st_size != size:
+        return False
+    time.sleep(CSV_SETTLE_SECONDS)
+    return os.fstat(f.fileno()).st_size == size
+
+
+def _iter_excel_from_row(path, source, chunksize=100_000):
+    """略過已套用的前 source['rows'] 列，只回傳之後的資料列
+
+    xlsx 是壓縮的 XML，無法從位移接續讀取，因此每次更新仍須以唯讀模式重新解析整個活頁簿；
+    已套用的資料列以逐列雜湊的累積摘要比對，不符 (活頁簿被改寫或資料列變少) 時設定
+    source['rewritten'] 並停止，不回傳任何資料列。
+    """
+    applied = source.get('rows', 0)
+    digest = hashlib.sha1()
+    seen = 0
+    for chunk in _iter_raw_chunks(path, chunksize):
+        start, seen = seen, seen + len(chunk)
+        row_hashes = pd.util.hash_pandas_object(chunk, index=False).values
+        if start < applied:
+            digest.update(row_hashes[:applied - start].tobytes())
+            if seen < applied:
+                continue
+            if digest.hexdigest() != source.get('digest'):
+                source['rewritten'] = True
+                return
+        new = slice(max(applied - start, 0), None)
+        if len(chunk.iloc[new]) > 0:
+            digest.update(row_hashes[new].tobytes())
+            source['rows'], source['digest'] = seen, digest.hexdigest()
+            yield chunk.iloc[new]
+    if seen < applied:
+        source['rewritten'] = True
+
+
+def _iter_new_chunks(path, source, chunksize=100_000):
+    """只讀取上次更新之後的新資料列
+
+    CSV 若只被附加 (位移前的內容未變)，直接從上次的位元組位移接續讀取；Excel 依已套用的列數略過舊資料列。
+    來源被改寫 (CSV 位移前的內容改變、Excel 已套用的資料列不符) 時不回傳任何資料列，
+    並設定 source['rewritten']，由呼叫端重新完整建立。
+    """
+    if not _is_csv(path):
+        yield from _iter_excel_from_row(path, source, chunksize)
+        return
+    offset = source.get('offset', 0)
+    if offset > 0 and (os.path.getsize(path) < offset or source.get('tail') != _csv_tail_digest(path, offset)):
+        source['rewritten'] = True
+        return
+    yield from _iter_csv_from_offset(path, source, chunksize)
+    source['tail'] = _csv_tail_digest(path, source['offset'])
+
+
+STATE_VERSION = 8
+
+
+class StreamingAggregator:
+    """串流彙總器：逐批累加儀表板所需的統計，跨批次的案例以延續狀態接續
+
+    假設來源依紀錄時間大致排序 (ADC 系統匯出的順序)；某批次開始之前的日期
+    所屬案例即視為已結束，其處理時間寫入結果後便釋放狀態。
+    流程變體以序列雜湊接續跨批次的案例；變體只保留案例數、事件數、總處理時間與路徑，
+    因此串流模式的變體只有平均處理時間 (中位數與 P90 需完整資料)。
+    """
+
+    TIMELINE_CASES = 20
+    # 狀態檔中以欄位 dict 保存的自訂類別：pickle 只含 pandas/numpy/內建型別，
+    # 以腳本 (__main__) 或匯入模組執行時寫出的狀態檔可互相讀取
+    STATE_CLASSES = {'cube': EventCube, 'waiting_times': WaitingTimeSketch}
+
+    def __init__(self, hold_first_day=False):
+        self.total_records = 0
+        # 批次模式的單一檔案彙總：檔案第一天的案例可能從前一個檔案延續，不在彙總中途結算
+        self.hold_first_day = hold_first_day
+        self.first_date = None
+        self.first_time = None
+        # 與案例無關的計數：各批次的事件立方體逐一合併
+        self.cube = EventCube([], [], None, np.zeros((0, 0, 0, 24), dtype=np.int32))
+        self.transition_counts = pd.Series(dtype='int64', index=pd.MultiIndex.from_tuples([], names=['source', 'target']))
+        # 轉換等待時間：固定分箱的直方圖，各批次 (含跨批次的轉換) 直接相加
+        self.waiting_times = WaitingTimeSketch.empty()
+        self.open_cases = None
+        # 已結束案例的處理時間：每個病房以水庫抽樣保留至多 DURATION_SAMPLE_LIMIT 筆
+        self.duration_samples = {}
+        self.duration_seen = {}
+        self.rng = np.random.default_rng(0)
+        self.num_closed_cases = 0
+        self.closed_before = None
+        self.watermark = None
+        self.timeline_case_ids = []
+        self.timeline_events = []
+        # 病歷號對照表：跨批次沿用，讓同一案例在各批次的案例鍵一致
+        self.patients = None
+        # 已結束案例的流程變體：以 (h1, h2) 雜湊為鍵，路徑文字只為每個變體記一次
+        self.variant_stats = pd.DataFrame(
+            {'案例數': pd.Series(dtype='int64'), '事件數': pd.Series(dtype='int64'),
+             '總處理時間(分鐘)': pd.Series(dtype='float64'), '首次出現': pd.Series(dtype='datetime64[ns]')},
+            index=pd.MultiIndex.from_arrays([np.empty(0, dtype=np.uint64)] * 2, names=['h1', 'h2']))
+        self.variant_paths = {}
+
+    @staticmethod
+    def _add_counts(total, counts):
+        return total.add(counts, fill_value=0).astype('int64')
+
+    def update(self, chunk):
+        """累加一批原始事件"""
+        chunk = _derive_event_columns(chunk[EVENT_COLUMNS].copy(), self.patients)
+        self.patients = chunk['病歷號'].cat.categories
+        if chunk.empty:
+            return
+        self.total_records += len(chunk)
+        last_time = chunk['紀錄時間'].iloc[-1]
+        if self.watermark is None or last_time > self.watermark:
+            self.watermark = last_time
+
+        # 與案例無關的計數
+        self.cube = self.cube.merge(EventCube.from_events(chunk))
+
+        # 本批次內的案例與轉換：轉換以動作代碼 bincount 計數，只有非零的組合才還原成名稱
+        # (各批次的動作/病房代碼不同，跨批次保存的狀態以名稱為鍵)
+        engine = CaseEngine(chunk)
+        cases = engine.cases.set_index('案例ID')
+        activities = np.asarray(chunk['動作'].cat.categories, dtype=object)
+        codes = engine.sorted['動作'].cat.codes.values.astype(np.intp)
+        cases['病房'] = np.asarray(cases['病房'], dtype=object)
+        cases['日期'] = engine.sorted['日期'].values[engine.starts]
+        cases['首動作'] = np.where(codes[engine.starts] >= 0, activities[codes[engine.starts]], None)
+        cases['末動作'] = np.where(codes[engine.ends - 1] >= 0, activities[codes[engine.ends - 1]], None)
+        cases['末病房'] = np.asarray(engine.sorted['病房'], dtype=object)[engine.ends - 1]
+        src, dst = codes[engine.pair_pos], codes[engine.pair_pos + 1]
+        valid = (src >= 0) & (dst >= 0)
+        n = len(activities)
+        pair_counts = np.bincount(src[valid] * n + dst[valid], minlength=n * n)
+        nonzero = np.flatnonzero(pair_counts)
+        transition_counts = pd.Series(pair_counts[nonzero], index=pd.MultiIndex.from_arrays(
+            [activities[nonzero // n], activities[nonzero % n]], names=['source', 'target']))
+        waiting_times = WaitingTimeSketch.from_dfg(DirectlyFollowsGraph.from_case_engine(engine))
+
+        # 本批次內各案例片段的序列雜湊；路徑文字只在需要時 (未結束的案例、新變體) 才還原
+        hashes = _sequence_hashes(codes, engine.starts, engine.ends, _activity_tokens(activities))
+        cases['h1'] = hashes[:, 0]
+        cases['h2'] = hashes[:, 1]
+        cases['路徑'] = None
+        cases['批次位置'] = np.arange(len(cases))
+        names = np.array([str(a) for a in activities] + ['nan'], dtype=object)
+
+        def segment_path(pos):
+            return ' → '.join(names[codes[engine.starts[pos]:engine.ends[pos]]])
+
+        # 接續上一批次尚未結束的案例：補上跨批次的轉換，保留最早的開始時間與病房
+        if self.open_cases is not None:
+            continued = cases.index.intersection(self.open_cases.index)
+            if len(continued) > 0:
+                bridge_counts, bridge_waits = self._stitch(self.open_cases.loc[continued], cases, continued)
+                transition_counts = self._add_counts(transition_counts, bridge_counts)
+                waiting_times = waiting_times.merge(bridge_waits)
+            cases = pd.concat([self.open_cases.drop(continued), cases])
+        self.transition_counts = self._add_counts(self.transition_counts, transition_counts)
+        self.waiting_times = self.waiting_times.merge(waiting_times)
+
+        # 時間軸抽樣：依時間先後記下前 20 個案例，並收集它們的事件
+        if len(self.timeline_case_ids) < self.TIMELINE_CASES:
+            # 已記下的案例最多 TIMELINE_CASES 個，只需檢查前 2 * TIMELINE_CASES 個新案例
+            new_ids = [c for c in engine.case_ids[:2 * self.TIMELINE_CASES] if c not in self.timeline_case_ids]
+            self.timeline_case_ids.extend(new_ids[:self.TIMELINE_CASES - len(self.timeline_case_ids)])
+        sampled = chunk[chunk['案例ID'].isin(self.timeline_case_ids)]
+        if not sampled.empty:
+            self.timeline_events.append(sampled[['案例ID', '紀錄時間', '動作', '病房']].astype({'動作': object, '病房': object}))
+
+        # 早於本批次最早日期的案例已不會再有事件，結算後釋放
+        first_date = chunk['日期'].iloc[0]
+        if self.closed_before is not None and first_date < self.closed_before:
+            print(f"警告：來源資料未依時間排序 ({first_date:%Y-%m-%d} 早於已結算的 {self.closed_before:%Y-%m-%d})，跨批次案例可能被拆開")
+        else:
+            self.closed_before = first_date
+        if self.first_date is None:
+            self.first_date = first_date
+            self.first_time = chunk['紀錄時間'].iloc[0]
+        is_closed = cases['日期'] < self.closed_before
+        if self.hold_first_day:
+            is_closed &= cases['日期'] > self.first_date
+        self._close_cases(cases[is_closed], segment_path)
+        # 未結束的案例帶著目前為止的完整路徑進入下一批次
+        open_cases = cases[~is_closed].copy()
+        open_cases['路徑'] = [self._case_path(prefix, pos, segment_path)
+                             for prefix, pos in zip(open_cases['路徑'], open_cases['批次位置'])]
+        open_cases['批次位置'] = -1
+        self.open_cases = open_cases
+
+    @staticmethod
+    def _stitch(prev, cases, continued):
+        """將同一案例的前段 (prev，依 continued 的順序) 接到 cases 中的後段 (就地更新)
+
+        保留前段的開始時間、病房與首動作，串接序列雜湊與路徑，回傳跨段轉換的 (次數, 等待時間摘要)。
+        後段的路徑為 None 時 (批次內片段尚未還原成文字) 只保留前段路徑，留待結算時再補上。
+        """
+        current = cases.loc[continued]
+        bridge = pd.DataFrame({'source': prev['末動作'].values, 'target': current['首動作'].values})
+        waited = (current['開始時間'].values - prev['結束時間'].values) / np.timedelta64(1, 's') / 60
+        waiting_times = WaitingTimeSketch.from_transitions(bridge['source'].values, bridge['target'].values,
+                                                           prev['末病房'].values, waited)
+        joined = _concat_sequence_hashes(prev[['h1', 'h2']].to_numpy(np.uint64), prev['事件數'].values,
+                                         current[['h1', 'h2']].to_numpy(np.uint64))
+        for column in ('開始時間', '病房', '首動作'):
+            cases.loc[continued, column] = prev[column].values
+        cases.loc[continued, 'h1'] = joined[:, 0]
+        cases.loc[continued, 'h2'] = joined[:, 1]
+        cases.loc[continued, '路徑'] = [prefix if segment is None else (f'{prefix} → {segment}' if prefix else segment)
+                                       for prefix, segment in zip(prev['路徑'], current['路徑'])]
+        cases.loc[continued, '事件數'] += prev['事件數'].values
+        return bridge.groupby(['source', 'target']).size(), waiting_times
+
+    def merge(self, other):
+        """併入另一個彙總器的結果 (例如批次模式中另一個檔案的部分彙總；other 應涵蓋較晚的資料)
+
+        other 的病歷號代碼先換成本彙總器的對照表，兩邊都尚未結束的同一案例 (跨越檔案邊界) 接成一個案例。
+        時間軸只能補上 other 自己抽樣到的案例事件，接續自本彙總器的抽樣案例在 other 中的後段可能不完整。
+        """
+        if other.total_records == 0:
+            return
+        if self.total_records == 0:
+            self.__dict__.update(other.__dict__)
+            self.hold_first_day = False
+            return
+        codes, self.patients = _encode_patients(pd.Series(np.asarray(other.patients, dtype=object)), self.patients)
+        codes = np.asarray(codes, dtype=np.int64)
+
+        def remap(keys):
+            keys = np.asarray(keys, dtype=np.int64)
+            return (keys & ~CASE_KEY_MASK) | codes[keys & CASE_KEY_MASK]
+
+        self.total_records += other.total_records
+        self.watermark = max(self.watermark, other.watermark)
+        self.closed_before = max(self.closed_before, other.closed_before)
+        self.cube = self.cube.merge(other.cube)
+        self.transition_counts = self._add_counts(self.transition_counts, other.transition_counts)
+        self.waiting_times = self.waiting_times.merge(other.waiting_times)
+
+        # 已結束的案例：變體統計相加，處理時間樣本依各自看過的筆數合併
+        self.num_closed_cases += other.num_closed_cases
+        self.variant_stats = self._combine_variant_stats(self.variant_stats, other.variant_stats)
+        self.variant_paths = {**other.variant_paths, **self.variant_paths}
+        for ward, samples in other.duration_samples.items():
+            self.duration_samples[ward], self.duration_seen[ward] = _reservoir_merge(
+                self.duration_samples.get(ward, np.empty(0)), self.duration_seen.get(ward, 0),
+                samples, other.duration_seen[ward], DURATION_SAMPLE_LIMIT, self.rng)
+
+        # 尚未結束的案例：跨越檔案邊界者接成一個案例
+        open_cases = other.open_cases.copy()
+        open_cases.index = pd.Index(remap(open_cases.index), name=open_cases.index.name)
+        continued = self.open_cases.index.intersection(open_cases.index)
+        if len(continued) > 0:
+            bridge_counts, bridge_waits = self._stitch(self.open_cases.loc[continued], open_cases, continued)
+            self.transition_counts = self._add_counts(self.transition_counts, bridge_counts)
+            self.waiting_times = self.waiting_times.merge(bridge_waits)
+        self.open_cases = pd.concat([self.open_cases.drop(continued), open_cases])
+
+        # 時間軸抽樣：不足 20 個案例時由 other 的抽樣補足
+        other_ids = [int(c) for c in remap(other.timeline_case_ids)]
+        self.timeline_case_ids.extend([c for c in other_ids if c not in self.timeline_case_ids]
+                                      [:self.TIMELINE_CASES - len(self.timeline_case_ids)])
+        if other.timeline_events:
+            events = pd.concat(other.timeline_events, ignore_index=True)
+            events['案例ID'] = remap(events['案例ID'].values)
+            events = events[events['案例ID'].isin(self.timeline_case_ids)]
+            if not events.empty:
+                self.timeline_events.append(events)
+
+    @staticmethod
+    def _case_path(prefix, pos, segment_path):
+        """案例的完整路徑：之前批次的路徑 + 本批次的片段 (pos < 0 表示本批次沒有新事件)"""
+        if pos < 0:
+            return prefix
+        segment = segment_path(pos)
+        return f'{prefix} → {segment}' if prefix else segment
+
+    def _merge_variants(self, cases, segment_path=None):
+        """將案例依變體彙總併入目前的變體統計，回傳 (新統計, 新變體的路徑)；不改變內部狀態"""
+        if cases.empty:
+            return self.variant_stats, {}
+        grouped = pd.DataFrame({
+            'h1': cases['h1'].values.astype(np.uint64), 'h2': cases['h2'].values.astype(np.uint64),
+            '事件數': cases['事件數'].values,
+            '總處理時間(分鐘)': ((cases['結束時間'] - cases['開始時間']).dt.total_seconds() / 60).values,
+            '首次出現': cases['開始時間'].values,
+            '列': np.arange(len(cases)),
+        }).groupby(['h1', 'h2'], sort=False).agg(
+            案例數=('事件數', 'size'), 事件數=('事件數', 'first'), 總處理時間=('總處理時間(分鐘)', 'sum'),
+            首次出現=('首次出現', 'min'), 列=('列', 'first')).rename(columns={'總處理時間': '總處理時間(分鐘)'})
+
+        new_keys = grouped.index.difference(self.variant_stats.index)
+        new_paths = {}
+        for key in new_keys:
+            row = cases.iloc[grouped.at[key, '列']]
+            new_paths[key] = self._case_path(row['路徑'], row['批次位置'], segment_path)
+
+        return self._combine_variant_stats(self.variant_stats, grouped.drop(columns='列')), new_paths
+
+    @staticmethod
+    def _combine_variant_stats(stats, other):
+        """相加兩份以 (h1, h2) 為鍵的變體統計"""
+        return pd.concat([stats, other]).groupby(level=['h1', 'h2'], sort=False).agg(
+            {'案例數': 'sum', '事件數': 'first', '總處理時間(分鐘)': 'sum', '首次出現': 'min'})
+
+    @staticmethod
+    def _case_durations(cases):
+        """計算案例處理時間，只保留至少兩筆事件且介於 0~1000 分鐘者"""
+        duration = (cases['結束時間'] - cases['開始時間']).dt.total_seconds() / 60
+        keep = (cases['事件數'] >= 2) & (duration > 0) & (duration < 1000)
+        return pd.DataFrame({'病房': cases.loc[keep, '病房'].values, '處理時間(分鐘)': duration[keep].values})
+
+    def _close_cases(self, cases, segment_path=None):
+        if cases.empty:
+            return
+        self.num_closed_cases += len(cases)
+        self.variant_stats, new_paths = self._merge_variants(cases, segment_path)
+        self.variant_paths.update(new_paths)
+        durations = self._case_durations(cases)
+        for ward, values in durations.groupby('病房', sort=False)['處理時間(分鐘)']:
+            self.duration_samples[ward], self.duration_seen[ward] = _reservoir_update(
+                self.duration_samples.get(ward, np.empty(0)), self.duration_seen.get(ward, 0),
+                values.values, DURATION_SAMPLE_LIMIT, self.rng)
+
+    def summary(self):
+        """回傳可直接繪圖的彙總結果 (尚未結束的案例以目前狀態計入，不改變內部狀態)"""
+        durations = [pd.DataFrame({'病房': ward, '處理時間(分鐘)': values}) for ward, values in self.duration_samples.items()]
+        num_cases = self.num_closed_cases
+        variant_stats, variant_paths = self.variant_stats, self.variant_paths
+        if self.open_cases is not None and not self.open_cases.empty:
+            durations.append(self._case_durations(self.open_cases))
+            num_cases += len(self.open_cases)
+            variant_stats, new_paths = self._merge_variants(self.open_cases)
+            variant_paths = {**variant_paths, **new_paths}
+
+        if self.timeline_events:
+            events = pd.concat(self.timeline_events, ignore_index=True)
+            timeline_df = InteractiveProcessMining._timeline_events(CaseEngine(events), self.patients, self.TIMELINE_CASES)
+        else:
+            timeline_df = pd.DataFrame(columns=['Case', 'Activity', 'Start', 'Finish', 'Ward'])
+
+        case_df = pd.concat(durations, ignore_index=True) if durations else pd.DataFrame(columns=['病房', '處理時間(分鐘)'])
+        ward_counts = self.cube.ward_counts()
+        activity_counts = self.cube.activity_counts()
+        return {
+            'activity_counts': activity_counts,
+            'ward_counts': ward_counts,
+            'daily_counts': self.cube.daily_counts(),
+            'hour_weekday': self.cube.hour_weekday(),
+            'trans_counts': self.transition_counts.reset_index(name='value'),
+            'case_df': case_df,
+            'timeline_df': timeline_df,
+            'variants': self._variant_summary(variant_stats, variant_paths),
+            'bottlenecks': self.waiting_times.top(20),
+            'num_transitions': len(self.waiting_times),
+            'stats': {
+                'total_records': self.total_records,
+                'num_wards': len(ward_counts),
+                'num_activities': len(activity_counts),
+                'num_cases': num_cases,
+            },
+        }
+
+    @staticmethod
+    def _variant_summary(variant_stats, variant_paths, k=20):
+        """由變體統計整理出與完整模式相同格式的前 k 名變體 (中位數與 P90 無法由串流狀態得到)"""
+        ordered = variant_stats.reset_index().sort_values(['案例數', '首次出現'], ascending=[False, True], kind='stable')
+        table = pd.DataFrame({
+            'h1': ordered['h1'].values, 'h2': ordered['h2'].values,
+            '案例數': ordered['案例數'].values.astype(np.int64), '事件數': ordered['事件數'].values.astype(np.int64),
+            '平均處理時間(分鐘)': (ordered['總處理時間(分鐘)'] / ordered['案例數']).values,
+            '中位數處理時間(分鐘)': np.nan, 'P90處理時間(分鐘)': np.nan,
+        })
+        overview = _variant_overview(table, k)
+        overview['top']['路徑'] = [variant_paths[key] for key in zip(overview['top']['h1'], overview['top']['h2'])]
+        return overview
+
+    def save(self, state_path, source=None):
+        """將彙總狀態 (含來源讀取位置) 寫入檔案，供增量更新接續"""
+        if len(self.timeline_events) > 1:
+            self.timeline_events = [pd.concat(self.timeline_events, ignore_index=True)]
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+        state = dict(self.__dict__)
+        for name in self.STATE_CLASSES:
+            state[name] = dict(vars(state[name]))
+        tmp_path = state_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': STATE_VERSION, 'source': source, 'state': state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, state_path)
+
+    @staticmethod
+    def load(state_path):
+        """讀取彙總狀態；不存在或版本不符時回傳 (None, None)"""
+        if not os.path.exists(state_path):
+            return None, None
         try:
-            with open('index.html', 'w', encoding='utf-8') as f:
-                f.write(html_content)
-            print("\n============================================================")
-            print("成功！ 互動式分頁儀表板已生成: index.html")
-            print("(v6: 已修正空白圖表問題)")
-            print("============================================================")
+            with open(state_path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            print(f"狀態檔無法讀取，將重新建立: {e}")
+            return None, None
+        if state.get('version') != STATE_VERSION:
+            return None, None
+        aggregator = StreamingAggregator()
+        aggregator.__dict__.update(state['state'])
+        for name, cls in StreamingAggregator.STATE_CLASSES.items():
+            fields = getattr(aggregator, name)
+            setattr(aggregator, name, cls.__new__(cls))
+            vars(getattr(aggregator, name)).update(fields)
+        return aggregator, state['source']
+
+
+def _render_summary_figures(summary, compact=False, profiler=None):
+    """由彙總結果繪製儀表板的各張圖表，每張各記錄為一個階段"""
+    tool = InteractiveProcessMining
+    profiler = profiler or StageProfiler()
+    print("建構 1~9. 由彙總結果繪製圖表...")
+    renderers = {
+        'pie': (summary['activity_counts'], lambda: tool._render_activity_pie_chart(summary['activity_counts'])),
+        'bar': (summary['ward_counts'], lambda: tool._render_ward_bar_chart(summary['ward_counts'])),
+        'sankey': (summary['trans_counts'], lambda: tool._render_process_flow_network(summary['trans_counts'])),
+        'variants': (summary['variants']['top'], lambda: tool._render_variant_chart(summary['variants'])),
+        'bottleneck': (summary['bottlenecks'], lambda: tool._render_bottleneck_chart(summary['bottlenecks'], summary['num_transitions'])),
+        'timeline': (summary['timeline_df'], lambda: tool._render_activity_timeline(
+            summary['timeline_df'], compact, TIMELINE_SAMPLING_LABELS['first'].format(n=summary['timeline_df']['Case'].nunique()))),
+        'heatmap': (summary['hour_weekday'], lambda: tool._render_performance_heatmap(summary['hour_weekday'])),
+        'violin': (summary['case_df'], lambda: tool._render_duration_violin_plot(summary['case_df'], compact)),
+        'trend': (summary['daily_counts'], lambda: tool._render_daily_trend_scatter(summary['daily_counts'])),
+    }
+    figures = {}
+    for key, (data, render) in renderers.items():
+        with profiler.stage(f'render:{key}', rows_in=len(data)) as record:
+            figures[key] = render()
+        record['rows_out'] = _figure_rows(figures[key])
+    return figures
+
+
+def generate_streaming_dashboard(data_path, chunksize=100_000, output_path='index.html', lazy=False, compress=False, compact=False,
+                                 profiler=None):
+    """串流模式：分批讀取 CSV/Excel，以有限記憶體產生儀表板"""
+    profiler = profiler or StageProfiler()
+    print(f"以串流模式從 {data_path} 分批載入資料中 (每批 {chunksize:,} 筆)...")
+    aggregator = StreamingAggregator()
+    try:
+        with profiler.stage('stream_aggregate') as record:
+            for i, chunk in enumerate(_iter_raw_chunks(data_path, chunksize), start=1):
+                aggregator.update(chunk)
+                print(f"  已處理第 {i} 批，累計 {aggregator.total_records:,} 筆記錄")
+            record['rows_in'] = aggregator.total_records
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案！請確認 '{data_path}' 路徑是否正確。")
+        sys.exit(1)
+    except Exception as e:
+        print(f"串流讀取檔案時發生未預期的錯誤: {e}")
+        sys.exit(1)
+
+    with profiler.stage('summary', rows_in=aggregator.total_records):
+        summary = aggregator.summary()
+    print(f"資料載入完成！共 {summary['stats']['total_records']} 筆記錄")
+    print("\n開始生成互動式分頁儀表板...")
+    figures = _render_summary_figures(summary, compact, profiler)
+    InteractiveProcessMining._write_dashboard_html(figures, summary['stats'], output_path, lazy, compress, profiler)
+
+
+BATCH_EXTENSIONS = ('.xlsx', '.xlsm', '.xls', '.csv', '.txt')
+
+
+def _resolve_batch_inputs(pattern):
+    """批次模式的輸入：目錄 (其中所有 Excel/CSV 檔) 或萬用字元路徑，依檔名排序"""
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern)
+    # 略過 Excel 開啟中的暫存檔 (~$ 開頭)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(BATCH_EXTENSIONS)
+                  and not os.path.basename(p).startswith('~$'))
+
+
+def _aggregate_file(path, chunksize=100_000, trace_memory=False, profile_dir=None):
+    """批次模式的工作者：以串流方式彙總單一檔案 (保留檔案第一天的案例供跨檔案接續)，連同階段紀錄回傳"""
+    profiler = StageProfiler(trace_memory, profile_dir)
+    aggregator = StreamingAggregator(hold_first_day=True)
+    with profiler.stage(f'parse:{os.path.basename(path)}') as record:
+        for chunk in _iter_raw_chunks(path, chunksize):
+            aggregator.update(chunk)
+        record['rows_out'] = aggregator.total_records
+    return path, aggregator, profiler.records
+
+
+def generate_batch_dashboard(pattern, output_path='index.html', workers=1, chunksize=100_000, lazy=False, compress=False,
+                             compact=False, profiler=None):
+    """批次模式：以多個工作者行程平行彙總多個檔案 (例如每月、每院區各一份)，再依時間先後合併成一份儀表板"""
+    profiler = profiler or StageProfiler()
+    paths = _resolve_batch_inputs(pattern)
+    if not paths:
+        print(f"錯誤：{pattern} 找不到任何 Excel 或 CSV 檔案。")
+        sys.exit(1)
+    workers = max(min(workers, len(paths)), 1)
+    print(f"批次模式：以 {workers} 個工作者平行彙總 {len(paths)} 個檔案...")
+
+    partials = []
+    # 單一工作者時各檔案在主行程依序彙總，各自以 profiler 的設定量測 (cProfile/tracemalloc)；
+    # 外層階段改用只計時的 profiler，避免在同一執行緒中巢狀啟動 cProfile
+    aggregate_profiler = profiler if workers > 1 else StageProfiler()
+    with aggregate_profiler.stage('batch_aggregate') as record:
+        if workers > 1:
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = {executor.submit(_aggregate_file, path, chunksize, profiler.trace_memory, profiler.profile_dir): path
+                           for path in paths}
+                for future in as_completed(futures):
+                    try:
+                        partials.append(future.result())
+                    except Exception as e:
+                        print(f"錯誤：彙總 {futures[future]} 時發生錯誤: {e}")
+                        sys.exit(1)
+                    print(f"  已彙總 {os.path.basename(partials[-1][0])} ({partials[-1][1].total_records:,} 筆記錄)")
+        else:
+            for path in paths:
+                try:
+                    partials.append(_aggregate_file(path, chunksize, profiler.trace_memory, profiler.profile_dir))
+                except Exception as e:
+                    print(f"錯誤：彙總 {path} 時發生錯誤: {e}")
+                    sys.exit(1)
+                print(f"  已彙總 {os.path.basename(path)} ({partials[-1][1].total_records:,} 筆記錄)")
+        record['rows_in'] = sum(aggregator.total_records for _, aggregator, _ in partials)
+    if aggregate_profiler is not profiler:
+        profiler.extend(aggregate_profiler.records)
+
+    # 依各檔案的第一筆紀錄時間 (其次檔名) 依序合併，跨越檔案邊界的案例在合併時接續
+    with profiler.stage('batch_merge', rows_in=len(partials)):
+        aggregator = StreamingAggregator()
+        for path, partial, records in sorted(partials, key=lambda p: (p[1].first_time is None, p[1].first_time or 0, p[0])):
+            profiler.extend(records)
+            aggregator.merge(partial)
+
+    with profiler.stage('summary', rows_in=aggregator.total_records):
+        summary = aggregator.summary()
+    print(f"資料載入完成！共 {summary['stats']['total_records']} 筆記錄 (來自 {len(paths)} 個檔案)")
+    print("\n開始生成互動式分頁儀表板...")
+    figures = _render_summary_figures(summary, compact, profiler)
+    InteractiveProcessMining._write_dashboard_html(figures, summary['stats'], output_path, lazy, compress, profiler)
+
+
+def refresh_incremental_dashboard(data_path, state_path=None, output_path='index.html', chunksize=100_000, lazy=False, compress=False, compact=False,
+                                  profiler=None):
+    """增量模式：讀取上次保存的彙總狀態，只套用上次之後新增的資料列，再重新輸出儀表板"""
+    profiler = profiler or StageProfiler()
+    if state_path is None:
+        state_path = os.path.join(os.path.dirname(os.path.abspath(data_path)), '.adc_cache', os.path.basename(data_path) + '.state.pkl')
+
+    with profiler.stage('load_state'):
+        aggregator, source = StreamingAggregator.load(state_path)
+    if aggregator is None or source is None or source.get('path') != os.path.abspath(data_path):
+        print(f"找不到可用的增量狀態，將從 {data_path} 完整建立...")
+        aggregator = StreamingAggregator()
+        source = {'path': os.path.abspath(data_path)}
+    else:
+        print(f"已載入增量狀態 (水位線: {aggregator.watermark}，累計 {aggregator.total_records:,} 筆記錄)")
+
+    new_rows = 0
+    try:
+        with profiler.stage('apply_new_rows') as record:
+            for chunk in _iter_new_chunks(data_path, source, chunksize):
+                aggregator.update(chunk)
+                new_rows += len(chunk)
+            if source.pop('rewritten', False):
+                print(f"{data_path} 已被改寫 (已套用的資料列不符)，將完整重新建立...")
+                aggregator = StreamingAggregator()
+                source = {'path': os.path.abspath(data_path)}
+                for chunk in _iter_new_chunks(data_path, source, chunksize):
+                    aggregator.update(chunk)
+                    new_rows += len(chunk)
+            record['rows_in'] = new_rows
+            record['rows_out'] = aggregator.total_records
+    except FileNotFoundError:
+        print(f"錯誤：找不到檔案！請確認 '{data_path}' 路徑是否正確。")
+        sys.exit(1)
+    except Exception as e:
+        print(f"增量讀取檔案時發生未預期的錯誤: {e}")
+        sys.exit(1)
+
+    with profiler.stage('save_state'):
+        aggregator.save(state_path, source)
+    print(f"本次套用 {new_rows:,} 筆新記錄，水位線更新至 {aggregator.watermark}")
+
+    with profiler.stage('summary', rows_in=aggregator.total_records):
+        summary = aggregator.summary()
+    print("\n開始生成互動式分頁儀表板...")
+    figures = _render_summary_figures(summary, compact, profiler)
+    InteractiveProcessMining._write_dashboard_html(figures, summary['stats'], output_path, lazy, compress, profiler)
+
+
+class AggregateCache:
+    """以位元組數為上限的 LRU 快取，供查詢伺服器保存篩選後的資料與圖表
+
+    相同鍵的並行請求只會計算一次：第一個請求負責計算，其餘請求等待結果。
+    超過上限時淘汰最久未使用的項目；單一項目大於上限時只回傳、不保存。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute, size_of=len):
+        """取得快取值；未命中時呼叫 compute() 計算並以 size_of(值) 計入大小"""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            waiter = self.pending.get(key)
+            if waiter is None:
+                waiter = self.pending[key] = threading.Event()
+                waiter.result = waiter.error = None
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+                self.hits += 1
+        if not owner:
+            waiter.wait()
+            if waiter.error is not None:
+                raise waiter.error
+            return waiter.result
+
+        try:
+            value = compute()
         except Exception as e:
-            print(f"寫入 index.html 時發生錯誤: {e}")
+            waiter.error = e
+            raise
+        else:
+            waiter.result = value
+            self._store(key, value, size_of(value))
+            return value
+        finally:
+            with self.lock:
+                del self.pending[key]
+            waiter.set()
+
+    def _store(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def _view_bytes(view):
+    """篩選後分析器的估計大小：事件表與案例引擎排序後的事件表"""
+    size = int(view.df.memory_usage(index=False).sum())
+    if view._case_engine is not None:
+        size += int(view._case_engine.sorted.memory_usage(index=False).sum())
+    return size + view.get_event_cube().counts.nbytes
+
+
+class DashboardService:
+    """查詢伺服器的資料層：常駐已載入的事件資料，依篩選條件產生圖表 JSON 與統計數字
+
+    篩選條件正規化為 (病房, 動作, 起日, 迄日, 案例定義, 閒置分鐘) 元組 (病房與動作依對照表順序排列、
+    日期為含迄日的 YYYY-MM-DD、案例定義與啟動時相同者為 None)，
+    篩選後的分析器與每張圖表的 JSON 都以此為鍵存入同一個 LRU 快取。
+    """
+
+    def __init__(self, tool, cache_bytes):
+        self.tool = tool
+        self.cache = AggregateCache(cache_bytes)
+        self.builders = dict(DASHBOARD_BUILDERS)
+        cube = tool.get_event_cube()
+        self.wards = {str(label): label for label in cube.ward_counts().index}
+        self.activities = {str(label): label for label in cube.activity_counts().index}
+        dates = cube.daily_counts().index
+        self.date_range = (str(dates.min()), str(dates.max())) if len(dates) else (None, None)
+
+    @staticmethod
+    def _select(values, known, name):
+        """多選條件：可重複給參數或以逗號分隔；未給時為 None (不篩選)"""
+        names = [v for value in values for v in value.split(',') if v]
+        if not names:
+            return None
+        unknown = [v for v in names if v not in known]
+        if unknown:
+            raise ValueError(f"未知的{name}: {', '.join(unknown)}")
+        order = list(known)
+        return tuple(sorted(set(names), key=order.index))
+
+    @staticmethod
+    def _date(values, name):
+        if not values or not values[-1]:
+            return None
+        try:
+            return pd.Timestamp(values[-1]).strftime('%Y-%m-%d')
+        except ValueError:
+            raise ValueError(f"無法解析的{name}: {values[-1]}") from None
+
+    def _case(self, case_values, gap_values):
+        """案例定義 (case) 與 session 的閒置分鐘數 (gap)；與啟動時的定義相同時為 (None, None)"""
+        notion = case_values[-1] if case_values and case_values[-1] else self.tool.case_notion
+        if notion not in CASE_NOTIONS:
+            raise ValueError(f"未知的案例定義: {notion}")
+        gap = None
+        if notion == 'session':
+            try:
+                gap = float(gap_values[-1]) if gap_values and gap_values[-1] else float(self.tool.case_gap_minutes)
+            except ValueError:
+                raise ValueError(f"無法解析的閒置分鐘數: {gap_values[-1]}") from None
+            if not gap > 0:
+                raise ValueError("閒置分鐘數必須大於 0")
+        if notion == self.tool.case_notion and (notion != 'session' or gap == self.tool.case_gap_minutes):
+            return None, None
+        return notion, gap
+
+    def normalize(self, query):
+        """將查詢字串 (wards, activities, start, end, case, gap) 正規化為快取鍵；條件不合法時拋出 ValueError"""
+        params = parse_qs(query)
+        filters = (self._select(params.get('wards', []), self.wards, '病房'),
+                   self._select(params.get('activities', []), self.activities, '動作'),
+                   self._date(params.get('start'), '起日'), self._date(params.get('end'), '迄日'),
+                   *self._case(params.get('case'), params.get('gap')))
+        if filters[2] is not None and filters[3] is not None and filters[2] > filters[3]:
+            raise ValueError("起日不可晚於迄日")
+        return filters
+
+    @staticmethod
+    def query_string(filters):
+        """由正規化後的篩選條件還原查詢字串 (頁面中各圖表的資料網址使用)"""
+        wards, activities, start, end, case, gap = filters
+        params = [('wards', ','.join(wards)) if wards else None, ('activities', ','.join(activities)) if activities else None,
+                  ('start', start) if start else None, ('end', end) if end else None,
+                  ('case', case) if case else None, ('gap', f'{gap:g}') if gap is not None else None]
+        return urlencode([p for p in params if p])
+
+    def view(self, filters):
+        """取得篩選後的分析器；篩選後的案例引擎在此一併建立，避免並行的圖表請求各自建立
+
+        改用其他案例定義時，先以完整資料重算案例鍵 (同樣存入快取)，再套用病房/動作/日期篩選，
+        因此篩選不會切斷跨病房或跨日的案例。
+        """
+        wards, activities, start, end, case, gap = filters
+        if case is None:
+            base = self.tool
+        else:
+            base = self.cache.get_or_compute(('cases', case, gap), lambda: self.tool.with_case_notion(case, gap), _view_bytes)
+        if wards is None and activities is None and start is None and end is None:
+            if case is not None:
+                base._get_case_engine()
+            return base
+        wards = None if wards is None else [self.wards[w] for w in wards]
+        activities = None if activities is None else [self.activities[a] for a in activities]
+        end = None if end is None else pd.Timestamp(end) + pd.Timedelta(days=1)
+
+        def build():
+            view = base.filtered(wards, activities, start, end)
+            view._get_case_engine()
+            return view
+        return self.cache.get_or_compute(('view', filters), build, _view_bytes)
+
+    def chart(self, filters, key):
+        """取得圖表 JSON (bytes)"""
+        method = self.builders[key]
+        return self.cache.get_or_compute(('chart', filters, key),
+                                         lambda: getattr(self.view(filters), method)().to_json().encode('utf-8'))
+
+    def stats(self, filters):
+        return self.cache.get_or_compute(('stats', filters), lambda: self.view(filters).dashboard_stats(), lambda _: 256)
+
+    def page(self, filters):
+        """篩選列 + 分頁儀表板；各分頁的圖表在首次開啟時才向 /api/chart/<分頁> 取得"""
+        query = self.query_string(filters)
+        fragments = {key: f'<div class="plotly-lazy" data-key="{key}" data-src="/api/chart/{key}?{html.escape(query)}" '
+                          f'style="min-height:500px; width:100%;"><p class="lazy-status">圖表載入中...</p></div>'
+                     for key, _ in DASHBOARD_BUILDERS}
+        return InteractiveProcessMining._render_dashboard_page(fragments, self.stats(filters), '/assets/plotly.min.js',
+                                                               LAZY_LOADER_JS, self._controls_html(filters))
+
+    def _controls_html(self, filters):
+        wards, activities, start, end, case, gap = filters
+        case = case or self.tool.case_notion
+        gap = self.tool.case_gap_minutes if gap is None else gap
+
+        def options(known, selected):
+            return ''.join(f'<option value="{html.escape(name)}"{" selected" if selected and name in selected else ""}>'
+                           f'{html.escape(name)}</option>' for name in known)
+        case_options = ''.join(f'<option value="{notion}"{" selected" if notion == case else ""}>{label}</option>'
+                               for notion, label in CASE_NOTION_LABELS.items())
+        first_day, last_day = self.date_range
+        return f"""
+        <form class="filter-bar" method="get" action="/">
+            <label>病房<select name="wards" multiple size="4">{options(self.wards, wards)}</select></label>
+            <label>動作<select name="activities" multiple size="4">{options(self.activities, activities)}</select></label>
+            <label>起日<input type="date" name="start" value="{start or ''}" min="{first_day or ''}" max="{last_day or ''}"></label>
+            <label>迄日<input type="date" name="end" value="{end or ''}" min="{first_day or ''}" max="{last_day or ''}"></label>
+            <label>案例定義<select name="case">{case_options}</select></label>
+            <label>閒置分鐘<input type="number" name="gap" value="{gap:g}" min="1" step="1" title="案例定義為閒置間隔切分時使用"></label>
+            <button type="submit">套用篩選</button>
+            <a href="/">清除</a>
+        </form>"""
+
+
+class _DashboardRequestHandler(BaseHTTPRequestHandler):
+    """查詢伺服器的路由
+
+    /                      分頁儀表板 (查詢字串即篩選條件)
+    /api/chart/<分頁>      該分頁的圖表 JSON
+    /api/stats             統計數字
+    /api/options           可選的病房、動作、日期範圍與案例定義
+    /api/cache             快取使用狀況
+    /assets/plotly.min.js  本機 plotly.js
+    """
+
+    service = None
+    plotly_js = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        try:
+            if url.path == '/api/options':
+                first_day, last_day = self.service.date_range
+                self._send_json({'wards': list(self.service.wards), 'activities': list(self.service.activities),
+                                 'start': first_day, 'end': last_day, 'cases': list(CASE_NOTIONS)})
+            elif url.path == '/api/cache':
+                self._send_json(self.service.cache.stats())
+            elif url.path == '/assets/plotly.min.js':
+                self._send(200, 'application/javascript', self.plotly_js)
+            elif url.path.startswith('/api/chart/'):
+                key = url.path[len('/api/chart/'):]
+                if key not in self.service.builders:
+                    self._send_error(404, f"未知的分頁: {key}")
+                    return
+                self._send(200, 'application/json', self.service.chart(self.service.normalize(url.query), key))
+            elif url.path == '/api/stats':
+                self._send_json(self.service.stats(self.service.normalize(url.query)))
+            elif url.path in ('/', '/index.html'):
+                page = self.service.page(self.service.normalize(url.query))
+                self._send(200, 'text/html; charset=utf-8', page.encode('utf-8'))
+            else:
+                self._send_error(404, f"找不到 {url.path}")
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except Exception as e:  # 單一請求失敗不影響伺服器
+            self._send_error(500, f'{type(e).__name__}: {e}')
+
+    def _send_json(self, data):
+        self._send(200, 'application/json', json.dumps(data, ensure_ascii=False, default=int).encode('utf-8'))
+
+    def _send_error(self, status, message):
+        self._send(status, 'application/json', json.dumps({'error': message}, ensure_ascii=False).encode('utf-8'))
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def build_event_store(data_path, store_dir, append=False, profiler=None):
+    """將紀錄檔載入並衍生欄位後，依月份寫入 (或附加到) 事件庫目錄"""
+    profiler = profiler or StageProfiler()
+    tool = InteractiveProcessMining(data_path, use_cache=False, profiler=profiler)
+    try:
+        with profiler.stage('write_store', rows_in=len(tool.df)) as record:
+            record['rows_out'] = EventStore.write(tool.df, store_dir, append=append)
+    except (OSError, ValueError) as e:
+        print(f"錯誤：無法寫入事件庫 {store_dir}: {e}")
+        sys.exit(1)
+    store = EventStore(store_dir)
+    print(f"事件庫已寫入 {store_dir}：{record['rows_out']} 個分區有更新，共 {len(store.partitions)} 個分區、{len(store)} 筆記錄")
+
+
+def serve(data_path, host='127.0.0.1', port=8050, cache_mb=256, compact=False, profiler=None, start=None, end=None,
+          case_notion='patient_day', case_gap_minutes=DEFAULT_CASE_GAP_MINUTES, timeline_cases=20, timeline_sampling='first'):
+    """查詢伺服器：常駐載入的事件資料，依病房、日期區間、動作與案例定義篩選即時回應圖表資料"""
+    from plotly.offline import get_plotlyjs
+    tool = InteractiveProcessMining(data_path, compact=compact, profiler=profiler, start=start, end=end,
+                                    case_notion=case_notion, case_gap_minutes=case_gap_minutes,
+                                    timeline_cases=timeline_cases, timeline_sampling=timeline_sampling)
+    # 未篩選的儀表板最常被開啟，先建好共用的案例引擎、DFG、變體、等待時間摘要與事件立方體
+    tool.get_directly_follows_graph()
+    tool.get_trace_variants()
+    tool.get_waiting_times()
+    service = DashboardService(tool, cache_mb << 20)
+    # 只量測啟動時的載入與預先建構；請求的分析器由 tool 複製而來，一併沿用不記錄的 profiler
+    tool.profiler = _NullProfiler()
+
+    handler = type('DashboardRequestHandler', (_DashboardRequestHandler,),
+                   {'service': service, 'plotly_js': get_plotlyjs().encode('utf-8')})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"錯誤：無法在 {host}:{port} 啟動伺服器 ({e})")
+        sys.exit(1)
+    print(f"查詢伺服器已啟動: http://{host}:{port}/ (快取上限 {cache_mb} MB，按 Ctrl+C 結束)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n伺服器已停止")
+    finally:
+        server.server_close()
+
+
+def compute_stats(tool):
+    """無頭統計：總記錄數、病房數、動作類型、案例數、時間範圍與各病房/各動作的記錄數"""
+    stats = tool.dashboard_stats()
+    times = tool.df['紀錄時間']
+    ward_counts = tool.df['病房'].value_counts()
+    activity_counts = tool.df['動作'].value_counts()
+    return {
+        '總記錄數': int(stats['total_records']),
+        '病房數': int(stats['num_wards']),
+        '動作類型': int(stats['num_activities']),
+        '案例數': int(stats['num_cases']),
+        '起始時間': None if times.empty else times.iloc[0].isoformat(),
+        '結束時間': None if times.empty else times.iloc[-1].isoformat(),
+        '各病房記錄數': {str(k): int(v) for k, v in ward_counts[ward_counts > 0].items()},
+        '各動作記錄數': {str(k): int(v) for k, v in activity_counts[activity_counts > 0].items()},
+    }
+
+
+def write_stats(stats, output='-', fmt='json'):
+    """將統計結果輸出為 JSON 或 CSV (指標, 項目, 數值)；output 為 '-' 時寫到標準輸出"""
+    f = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    try:
+        if fmt == 'json':
+            json.dump(stats, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        else:
+            writer = csv.writer(f)
+            writer.writerow(['指標', '項目', '數值'])
+            for name, value in stats.items():
+                if isinstance(value, dict):
+                    writer.writerows([name, key, count] for key, count in value.items())
+                else:
+                    writer.writerow([name, '', value])
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def run_stats(data_path, output='-', fmt='json', start=None, end=None, profiler=None, case_notion='patient_day',
+              case_gap_minutes=DEFAULT_CASE_GAP_MINUTES):
+    """統計模式：只載入資料 (可用快取或事件庫) 並輸出摘要數字，不匯入 plotly，適合排程健康檢查"""
+    # 進度訊息改寫到標準錯誤，讓標準輸出只有統計結果，可直接接到其他程式
+    with contextlib.redirect_stdout(sys.stderr):
+        tool = InteractiveProcessMining(data_path, profiler=profiler, start=start, end=end, case_notion=case_notion,
+                                        case_gap_minutes=case_gap_minutes)
+        with tool.profiler.stage('stats', rows_in=len(tool.df)):
+            stats = compute_stats(tool)
+    try:
+        write_stats(stats, output, fmt)
+    except OSError as e:
+        print(f"錯誤：無法寫入 {output}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def _positive_int(text):
+    """argparse 型別：大於 0 的整數"""
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"必須是整數: {text}") from None
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"必須大於 0: {text}")
+    return value
+
+
+def _positive_float(text):
+    """argparse 型別：大於 0 的數值 (與查詢伺服器檢查閒置分鐘數的規則相同)"""
+    try:
+        value = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"必須是數值: {text}") from None
+    if not value > 0:
+        raise argparse.ArgumentTypeError(f"必須大於 0: {text}")
+    return value
+
+
+def _add_input_arguments(parser):
+    parser.add_argument('--data', help='ADC 事件紀錄檔 (Excel 或 CSV) 或事件庫目錄，預設為程式目錄下的 ADC系統_總表V2.xlsx')
+    parser.add_argument('--start', help='只載入此日期 (含) 之後的事件，例如 2024-01-01；事件庫只會讀取需要的分區')
+    parser.add_argument('--end', help='只載入此日期 (不含) 之前的事件')
+    parser.add_argument('--case', choices=CASE_NOTIONS, default='patient_day',
+                        help='案例定義：病歷號 + 日期 (預設)、病歷號 + 病房，或依閒置間隔切分 (串流/增量/批次模式僅支援預設)')
+    parser.add_argument('--case-gap', type=_positive_float, default=DEFAULT_CASE_GAP_MINUTES,
+                        help='--case session 時，同一病歷號相隔超過此分鐘數沒有事件即開始新案例')
+
+
+def _add_profiling_arguments(parser):
+    parser.add_argument('--metrics', help='將各階段的耗時、CPU 時間、記憶體與筆數寫入此 JSON 檔')
+    parser.add_argument('--profile-dir', help='每個階段各輸出一份 cProfile 檔 (<階段>.prof) 至此目錄')
+    parser.add_argument('--trace-memory', action='store_true', help='以 tracemalloc 記錄各階段的配置峰值 (會拖慢執行)')
+
+
+def _add_dashboard_arguments(parser):
+    parser.add_argument('--output', help='輸出的 HTML 檔案，預設為 index.html')
+    parser.add_argument('--stream', action='store_true', help='串流模式：分批讀取，適用超過記憶體大小的紀錄檔')
+    parser.add_argument('--refresh', action='store_true', help='增量模式：保存彙總狀態，只套用上次之後的新資料列')
+    parser.add_argument('--state', help='增量模式的狀態檔，預設為資料檔旁的 .adc_cache/<檔名>.state.pkl')
+    parser.add_argument('--chunksize', type=_positive_int, default=100_000, help='串流/增量模式每批讀取的列數')
+    parser.add_argument('--lazy', action='store_true', help='延遲載入：各圖表另存為 assets/ 下的 JSON，分頁首次開啟時才載入，並使用本機 plotly.js')
+    parser.add_argument('--gzip', action='store_true', help='延遲載入模式下以 gzip 壓縮圖表 JSON (需以 HTTP 伺服器開啟)')
+    parser.add_argument('--compact', action='store_true', help='精簡模式：處理時間分布與時間軸改送伺服器端預先彙總的資料，頁面大小不隨案例數成長')
+    parser.add_argument('--batch', metavar='DIR_OR_GLOB', help='批次模式：平行彙總目錄或萬用字元路徑 (例如 "exports/ADC_2024-*.xlsx") 下的所有紀錄檔，合併成一份儀表板')
+    parser.add_argument('--by-ward', action='store_true', help='另為每個病房各寫一份 <輸出檔名>_<病房>.html (與全院頁面一起平行產生)')
+    parser.add_argument('--workers', type=int, help='平行工作者數 (0 表示使用所有 CPU 核心)；一般模式預設 1，批次與病房模式預設使用所有核心')
+
+
+def _add_timeline_arguments(parser):
+    parser.add_argument('--timeline-cases', type=_positive_int, default=20, help='活動時間軸顯示的案例數 (長條過多時自動改用 WebGL 繪製)')
+    parser.add_argument('--timeline-sampling', choices=TIMELINE_SAMPLINGS, default='first',
+                        help='時間軸的案例抽樣：最早的案例、隨機、依病房分層、事件最多或處理時間最長 (串流/增量/批次模式僅支援 first)')
+
+
+def _add_serve_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1', help='查詢伺服器的位址')
+    parser.add_argument('--port', type=int, default=8050, help='查詢伺服器的連接埠')
+    parser.add_argument('--cache-mb', type=int, default=256, help='查詢伺服器快取篩選結果與圖表的記憶體上限 (MB)')
+
+
+def _inherit_defaults(subparser, parser):
+    """子命令中與主命令列同名的選項不設預設值 (argparse.SUPPRESS)
+
+    子命令的結果會覆寫到同一個 namespace；若保留預設值，寫在子命令之前的選項
+    (例如 --data s.csv stats) 會被子命令的預設值蓋掉。
+    """
+    shared = {action.dest for action in parser._actions if action.option_strings}
+    for action in subparser._actions:
+        if action.option_strings and action.dest in shared:
+            action.default = argparse.SUPPRESS
+
+
+def _build_parser():
+    """命令列：dashboard (預設)、serve、build-store、stats 四個子命令
+
+    不指定子命令時等同 dashboard；舊版的 --serve / --build-store 旗標仍可使用。
+    共用選項寫在子命令之前或之後皆可，子命令中的值優先。
+    """
+    parser = argparse.ArgumentParser(description='建立互動式流程挖掘儀表板')
+    _add_input_arguments(parser)
+    _add_dashboard_arguments(parser)
+    _add_timeline_arguments(parser)
+    _add_profiling_arguments(parser)
+    parser.add_argument('--serve', action='store_true', help='同 serve 子命令')
+    _add_serve_arguments(parser)
+    parser.add_argument('--build-store', metavar='DIR', help='同 build-store 子命令')
+    parser.add_argument('--append', action='store_true', help='搭配 --build-store：附加到既有事件庫，而非覆寫')
+    commands = parser.add_subparsers(dest='command', metavar='{dashboard,serve,build-store,stats}')
+
+    dashboard = commands.add_parser('dashboard', help='產生儀表板 HTML (預設)')
+    _add_input_arguments(dashboard)
+    _add_dashboard_arguments(dashboard)
+    _add_timeline_arguments(dashboard)
+    _add_profiling_arguments(dashboard)
+
+    serve_parser = commands.add_parser('serve', help='查詢伺服器：常駐資料並在瀏覽器中依病房、日期與動作篩選')
+    _add_input_arguments(serve_parser)
+    _add_serve_arguments(serve_parser)
+    serve_parser.add_argument('--compact', action='store_true', help='精簡模式')
+    _add_timeline_arguments(serve_parser)
+    _add_profiling_arguments(serve_parser)
+
+    store = commands.add_parser('build-store', help='將 --data 的紀錄依月份寫成事件庫目錄 (各欄為可記憶體映射的 .npy)')
+    store.add_argument('build_store', metavar='DIR', help='事件庫目錄')
+    store.add_argument('--data', help='ADC 事件紀錄檔 (Excel 或 CSV)')
+    store.add_argument('--append', action='store_true', help='附加到既有事件庫，而非覆寫')
+    _add_profiling_arguments(store)
+
+    stats = commands.add_parser('stats', help='只輸出統計數字 (JSON 或 CSV)，不繪圖也不匯入 plotly')
+    _add_input_arguments(stats)
+    stats.add_argument('--format', choices=['json', 'csv'], default='json', help='輸出格式')
+    stats.add_argument('--output', help='輸出檔案，預設為標準輸出')
+    _add_profiling_arguments(stats)
+
+    for subparser in (dashboard, serve_parser, store, stats):
+        _inherit_defaults(subparser, parser)
+    return parser
 
 
 def main():
     """主程式"""
+    args = _build_parser().parse_args()
+    command = args.command or ('serve' if args.serve else 'build-store' if args.build_store else 'dashboard')
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    data_path = args.data or os.path.join(script_dir, 'ADC系統_總表V2.xlsx')
+    output = args.output or ('-' if command == 'stats' else 'index.html')
+    profiler = StageProfiler(trace_memory=args.trace_memory, profile_dir=args.profile_dir)
+
+    if command == 'stats':
+        run_stats(data_path, output, args.format, args.start, args.end, profiler, args.case, args.case_gap)
+        if args.metrics:
+            profiler.write_json(args.metrics, data_path=data_path, output_path=output, mode='stats',
+                                trace_memory=args.trace_memory)
+        return
+
     print("="*60)
     print("建立互動式流程挖掘儀表板 (v6 - 修正空白圖表)")
     print("="*60)
     
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    data_path = os.path.join(script_dir, 'ADC系統_總表V2.xlsx')
-    
-    tool = InteractiveProcessMining(data_path)
-    
-    # --- 僅呼叫這一個主函數 ---
-    tool.generate_interactive_tabbed_dashboard()
+    if command == 'serve':
+        serve(data_path, args.host, args.port, args.cache_mb, args.compact, profiler, args.start, args.end,
+              args.case, args.case_gap, args.timeline_cases, args.timeline_sampling)
+        return
+    if command == 'build-store':
+        build_event_store(data_path, args.build_store, args.append, profiler)
+        if args.metrics:
+            profiler.write_json(args.metrics, data_path=data_path, output_path=args.build_store, mode='build_store',
+                                trace_memory=args.trace_memory)
+            print(f"各階段效能紀錄已寫入 {args.metrics}")
+        return
+
+    if args.workers is None:
+        workers = (os.cpu_count() or 1) if args.batch or args.by_ward else 1
+    else:
+        workers = args.workers or os.cpu_count() or 1
+    if (args.batch or args.refresh or args.stream) and args.case != 'patient_day':
+        print("錯誤：串流/增量/批次模式以日期為界結束案例，只支援 --case patient_day")
+        sys.exit(1)
+    if (args.batch or args.refresh or args.stream) and (args.timeline_sampling != 'first' or args.timeline_cases != 20):
+        print("錯誤：串流/增量/批次模式的時間軸固定為最早的 20 個案例，不支援 --timeline-cases / --timeline-sampling")
+        sys.exit(1)
+    if (args.batch or args.refresh or args.stream) and args.by_ward:
+        print("錯誤：--by-ward 需要完整載入事件資料，不能與串流/增量/批次模式同時使用")
+        sys.exit(1)
+    if args.batch:
+        mode = 'batch'
+        data_path = args.batch
+        generate_batch_dashboard(args.batch, output, workers, args.chunksize, args.lazy, args.gzip, args.compact, profiler)
+    elif args.refresh:
+        mode = 'refresh'
+        refresh_incremental_dashboard(data_path, args.state, output, args.chunksize, args.lazy, args.gzip, args.compact, profiler)
+    elif args.stream:
+        mode = 'stream'
+        generate_streaming_dashboard(data_path, args.chunksize, output, args.lazy, args.gzip, args.compact, profiler)
+    else:
+        mode = 'by_ward' if args.by_ward else 'full'
+        tool = InteractiveProcessMining(data_path, compact=args.compact, profiler=profiler, start=args.start, end=args.end,
+                                        case_notion=args.case, case_gap_minutes=args.case_gap,
+                                        timeline_cases=args.timeline_cases, timeline_sampling=args.timeline_sampling)
+        
+        if args.by_ward:
+            tool.generate_ward_dashboards(output, workers=workers, lazy=args.lazy, compress=args.gzip)
+        else:
+            # --- 僅呼叫這一個主函數 ---
+            tool.generate_interactive_tabbed_dashboard(output, workers=workers, lazy=args.lazy, compress=args.gzip)
+
+    if args.metrics:
+        profiler.write_json(args.metrics, data_path=data_path, output_path=output, mode=mode, workers=workers,
+                            lazy=args.lazy, compact=args.compact, trace_memory=args.trace_memory)
+        print(f"各階段效能紀錄已寫入 {args.metrics}")
     
     print("\n所有任務完成！")
-    print("請在您的瀏覽器中開啟 index.html 檔案。")
+    print(f"請在您的瀏覽器中開啟 {output} 檔案。")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+"""
+儀表板效能基準測試
+以 synthetic_log.py 產生指定筆數的合成紀錄，分別量測 load_data、案例引擎、
+各個 _build_* 圖表建構方法與 HTML 輸出的耗時，並回報每個規模的記憶體峰值
+(每個規模在獨立子行程中執行；加上 --trace-memory 可再細分到各階段)，
+用於發現規模化後的效能退化並估算儀表板排程所需的硬體規格。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue as queue_module
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from synthetic_log import parse_size, write_synthetic_log
+from Interactive_demo import InteractiveProcessMining, StageProfiler
+
+# 等待子行程結果時，每隔這麼多秒確認一次子行程是否仍在執行
+POLL_SECONDS = 1.0
+
+
+def run_single_benchmark(data_path, output_dir, trace_memory=False, compact=False, verbose=False):
+    """對單一資料檔量測各階段，回傳階段紀錄與整體統計"""
+    profiler = StageProfiler(trace_memory)
+    log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with log:
+        tool = InteractiveProcessMining(data_path, use_cache=False, compact=compact, profiler=profiler)
+        # 案例引擎、DFG 與流程變體由多個圖表共用，先建好以免算到第一個使用它的圖表上
+        tool.get_directly_follows_graph()
+        tool.get_trace_variants()
+        figures = tool.build_figures()
+        stats = tool.dashboard_stats()
+        output_path = os.path.join(output_dir, 'index.html')
+        InteractiveProcessMining._write_dashboard_html(figures, stats, output_path, profiler=profiler)
+    if trace_memory:
+        tracemalloc.stop()
+
+    return {
+        'stages': profiler.records,
+        'total_seconds': round(sum(r['wall_s'] for r in profiler.records), 4),
+        'max_rss_mb': profiler.records[-1]['max_rss_mb'],
+        'html_mb': round(os.path.getsize(output_path) / 1e6, 2),
+        'num_cases': int(stats['num_cases']),
+    }
+
+
+def _benchmark_worker(queue, *args):
+    try:
+        queue.put(('ok', run_single_benchmark(*args)))
+    except Exception as e:  # 將錯誤帶回主行程顯示
+        queue.put(('error', f'{type(e).__name__}: {e}'))
+
+
+def run_isolated(data_path, output_dir, trace_memory, compact, verbose):
+    """在獨立子行程中量測，讓每個規模的記憶體峰值 (ru_maxrss) 互不影響"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return run_single_benchmark(data_path, output_dir, trace_memory, compact, verbose)
+    ctx = multiprocessing.get_context('fork')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_benchmark_worker, args=(queue, data_path, output_dir, trace_memory, compact, verbose))
+    proc.start()
+    # 子行程被 OOM killer 等外力終止時不會回傳結果，不能無限期等待佇列
+    while True:
+        try:
+            status, result = queue.get(timeout=POLL_SECONDS)
+            break
+        except queue_module.Empty:
+            if not proc.is_alive():
+                try:
+                    status, result = queue.get(timeout=POLL_SECONDS)
+                    break
+                except queue_module.Empty:
+                    proc.join()
+                    raise RuntimeError(f"子行程意外結束 (結束碼 {proc.exitcode})，未回傳結果 (可能因記憶體不足被終止)") from None
+    proc.join()
+    if status != 'ok':
+        raise RuntimeError(result)
+    return result
+
+
+def _format_table(results):
+    """將各規模的結果排成「階段 × 規模」的文字表格"""
+    sizes = [r['label'] for r in results]
+    stage_names = [s['stage'] for s in results[0]['stages']]
+    width = max(len(name) for name in stage_names + ['total']) + 2
+    header = f"{'階段':<{width - 2}}" + ''.join(f'{size:>20}' for size in sizes)
+    lines = [header, '-' * len(header)]
+
+    def cell(stage):
+        text = f"{stage['wall_s']:.3f}s"
+        if stage.get('tracemalloc_peak_mb') is not None:
+            text += f" / {stage['tracemalloc_peak_mb']:.0f}MB"
+        return f'{text:>20}'
+
+    for i, name in enumerate(stage_names):
+        lines.append(f'{name:<{width}}' + ''.join(cell(r['stages'][i]) for r in results))
+    lines.append('-' * len(header))
+    lines.append(f"{'total':<{width}}" + ''.join(f"{r['total_seconds']:>19.3f}s" for r in results))
+    if results[0]['max_rss_mb'] is not None:
+        lines.append(f"{'max_rss':<{width}}" + ''.join(f"{r['max_rss_mb']:>18.0f}MB" for r in results))
+    lines.append(f"{'html':<{width}}" + ''.join(f"{r['html_mb']:>18.2f}MB" for r in results))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='以合成紀錄量測儀表板各階段的耗時與記憶體峰值')
+    parser.add_argument('--sizes', default='10k,100k', help='逗號分隔的筆數，例如 10k,100k,1M,10M')
+    parser.add_argument('--wards', type=int, default=4, help='病房數')
+    parser.add_argument('--activities', type=int, default=9, help='動作種類數')
+    parser.add_argument('--case-length', type=int, default=6, help='平均案例長度 (事件數)')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv', help='合成紀錄的檔案格式')
+    parser.add_argument('--compact', action='store_true', help='以精簡模式建構圖表')
+    parser.add_argument('--trace-memory', action='store_true', help='以 tracemalloc 追蹤各階段的記憶體峰值 (會明顯拖慢計時)')
+    parser.add_argument('--workdir', help='合成紀錄與輸出的暫存目錄，預設為系統暫存目錄 (結束後刪除)')
+    parser.add_argument('--json', help='另將結果寫入此 JSON 檔')
+    parser.add_argument('--verbose', action='store_true', help='顯示儀表板本身的進度訊息')
+    args = parser.parse_args()
+
+    try:
+        labels = [s.strip() for s in args.sizes.split(',') if s.strip()]
+        sizes = [parse_size(label) for label in labels]
+    except ValueError:
+        print(f"錯誤：無法解析筆數 {args.sizes}")
+        sys.exit(1)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='adc_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    results = []
+    try:
+        for label, n_rows in zip(labels, sizes):
+            data_path = os.path.join(workdir, f'synthetic_{label}.{args.format}')
+            print(f"[{label}] 產生 {n_rows:,} 筆合成紀錄...")
+            start = time.perf_counter()
+            try:
+                write_synthetic_log(data_path, n_rows, n_wards=args.wards, n_activities=args.activities,
+                                    mean_case_length=args.case_length)
+            except ValueError as e:
+                print(f"錯誤：{e}")
+                sys.exit(1)
+            generate_seconds = time.perf_counter() - start
+
+            print(f"[{label}] 量測中...")
+            output_dir = os.path.join(workdir, f'out_{label}')
+            os.makedirs(output_dir, exist_ok=True)
+            try:
+                result = run_isolated(data_path, output_dir, args.trace_memory, args.compact, args.verbose)
+            except RuntimeError as e:
+                print(f"錯誤：{label} 量測失敗 ({e})")
+                sys.exit(1)
+            result.update(label=label, rows=n_rows, generate_seconds=round(generate_seconds, 3))
+            results.append(result)
+            print(f"[{label}] 完成，共 {result['total_seconds']:.2f} 秒")
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print(_format_table(results))
+
+    if args.json:
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'tracemalloc': args.trace_memory,
+            'compact': args.compact,
+            'results': results,
+        }
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n結果已寫入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+完整模式與串流模式的一致性檢查
+以 synthetic_log.py 產生含同秒事件的合成紀錄，比較完整載入與不同批次大小的串流彙總
+所得的直接跟隨轉換次數與轉換瓶頸 (等待時間分位數)，兩者應完全相同；
+不一致時以非零結束碼離開，可放在排程或修改案例/排序邏輯後執行。
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from synthetic_log import parse_size, write_synthetic_log
+from Interactive_demo import InteractiveProcessMining, StreamingAggregator, _iter_raw_chunks
+
+
+def full_mode_results(data_path):
+    """完整模式的轉換次數 (source, target) 與瓶頸摘要"""
+    tool = InteractiveProcessMining(data_path, use_cache=False)
+    dfg = tool.get_directly_follows_graph()
+    edges = dfg.edge_stats()
+    counts = pd.Series(edges['value'].values, index=pd.MultiIndex.from_arrays(
+        [edges['source'].astype(str), edges['target'].astype(str)], names=['source', 'target']))
+    return counts, tool.get_waiting_times().summary()
+
+
+def stream_mode_results(data_path, chunksize):
+    """串流模式 (每批 chunksize 筆) 的轉換次數與瓶頸摘要"""
+    aggregator = StreamingAggregator()
+    for chunk in _iter_raw_chunks(data_path, chunksize):
+        aggregator.update(chunk)
+    counts = aggregator.transition_counts
+    counts.index = pd.MultiIndex.from_arrays([counts.index.get_level_values(0).astype(str),
+                                              counts.index.get_level_values(1).astype(str)], names=['source', 'target'])
+    return counts, aggregator.waiting_times.summary()
+
+
+def _normalize_counts(counts):
+    counts = counts[counts > 0].astype('int64')
+    return counts.sort_index()
+
+
+def _normalize_summary(summary):
+    summary = summary.copy()
+    for column in ('source', 'target', '病房'):
+        summary[column] = summary[column].astype(str)
+    return summary.sort_values(['source', 'target', '病房'], kind='stable').reset_index(drop=True)
+
+
+def _summaries_equal(left, right):
+    """鍵、次數與分位數須完全相同；平均值的加總順序不同，只比到浮點誤差"""
+    if not left.drop(columns='平均(分鐘)').equals(right.drop(columns='平均(分鐘)')):
+        return False
+    return bool(np.allclose(left['平均(分鐘)'], right['平均(分鐘)'], rtol=1e-9, atol=0))
+
+
+def compare(data_path, chunksizes):
+    """回傳不一致項目的說明清單 (空清單表示完全一致)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        full_counts, full_summary = full_mode_results(data_path)
+    full_counts, full_summary = _normalize_counts(full_counts), _normalize_summary(full_summary)
+    problems = []
+    for chunksize in chunksizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts, summary = stream_mode_results(data_path, chunksize)
+        if not _normalize_counts(counts).equals(full_counts):
+            problems.append(f"每批 {chunksize:,} 筆：直接跟隨轉換次數與完整模式不同")
+        if not _summaries_equal(_normalize_summary(summary), full_summary):
+            problems.append(f"每批 {chunksize:,} 筆：轉換瓶頸摘要與完整模式不同")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較完整模式與串流模式的直接跟隨圖與轉換瓶頸是否一致')
+    parser.add_argument('--rows', default='50k', help='合成紀錄筆數，例如 50k、1M')
+    parser.add_argument('--chunksizes', default='997,10000,100000', help='逗號分隔的串流批次大小')
+    parser.add_argument('--data', help='改用既有的 CSV/Excel 紀錄檔，不產生合成紀錄')
+    args = parser.parse_args()
+
+    try:
+        chunksizes = [parse_size(s) for s in args.chunksizes.split(',') if s.strip()]
+    except ValueError:
+        print(f"錯誤：無法解析批次大小 {args.chunksizes}")
+        sys.exit(1)
+
+    workdir = None
+    data_path = args.data
+    try:
+        if data_path is None:
+            workdir = tempfile.mkdtemp(prefix='adc_check_')
+            data_path = os.path.join(workdir, 'synthetic.csv')
+            n_rows = parse_size(args.rows)
+            print(f"產生 {n_rows:,} 筆合成紀錄...")
+            write_synthetic_log(data_path, n_rows)
+        print(f"比較完整模式與串流模式 (每批 {', '.join(f'{c:,}' for c in chunksizes)} 筆)...")
+        problems = compare(data_path, chunksizes)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if problems:
+        for problem in problems:
+            print(f"不一致：{problem}")
+        sys.exit(1)
+    print("一致：完整模式與串流模式的直接跟隨圖與轉換瓶頸完全相同")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+合成 ADC 事件紀錄產生器
+產生與 ADC系統_總表V2.xlsx 相同欄位 (病歷號, 紀錄時間, 動作, 病房) 的模擬資料，
+供效能測試與硬體規劃使用；可控制筆數、病房數、動作種類數與案例長度。
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 實際資料中出現的病房與動作，超過時以編號補足
+WARD_NAMES = ['9C', 'MIB', 'PI', '3W']
+ACTIVITY_NAMES = ['領藥', '調劑', '補藥', '新增', '存量不符', '移除', '調撥入藥', '管理者更新', '管理者刪除']
+
+# Excel 單一工作表的列數上限 (含標題列)
+EXCEL_MAX_ROWS = 1_048_575
+
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_size(text):
+    """解析 10k / 1M / 250000 這類筆數寫法"""
+    text = str(text).strip().lower().replace('_', '').replace(',', '')
+    if text and text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def _names(base, n, prefix):
+    return [base[i] if i < len(base) else f'{prefix}{i + 1:02d}' for i in range(n)]
+
+
+def _transition_matrix(n_activities, rng):
+    """建立偏斜的動作轉移機率矩陣：以「領藥」為中心，其餘動作依 Zipf 分布"""
+    weights = 1.0 / np.arange(1, n_activities + 1) ** 1.2
+    matrix = rng.dirichlet(weights * 20, size=n_activities)
+    matrix = 0.6 * matrix + 0.4 * weights / weights.sum()
+    return np.cumsum(matrix / matrix.sum(axis=1, keepdims=True), axis=1)
+
+
+def iter_synthetic_chunks(n_rows, n_wards=4, n_activities=9, mean_case_length=6, days=90,
+                          n_patients=None, chunk_rows=1_000_000, seed=0):
+    """依時間先後分批產生合成事件 (每批為數天份資料，批內已依紀錄時間排序)
+
+    每個案例代表一位病人在同一天於某病房的一連串操作：案例長度為幾何分布，
+    動作依馬可夫轉移矩陣產生，相鄰事件間隔為指數分布 (平均 10 分鐘)，
+    案例開始時間集中在白天班且不跨日。
+    """
+    rng = np.random.default_rng(seed)
+    wards = np.array(_names(WARD_NAMES, n_wards, 'W'))
+    activities = np.array(_names(ACTIVITY_NAMES, n_activities, '動作'))
+    ward_weights = rng.dirichlet(np.ones(n_wards) * 2)
+    cum_transition = _transition_matrix(n_activities, rng)
+    start_weights = 1.0 / np.arange(1, n_activities + 1) ** 1.5
+    start_weights /= start_weights.sum()
+    n_patients = n_patients or max(n_rows // (mean_case_length * 4), 10)
+
+    rows_per_day = max(n_rows / days, 1)
+    days_per_chunk = max(int(chunk_rows // rows_per_day), 1)
+    produced = 0
+    for first_day in range(0, days, days_per_chunk):
+        chunk_days = min(days_per_chunk, days - first_day)
+        target = n_rows - produced if first_day + chunk_days >= days else int(rows_per_day * chunk_days)
+        if target <= 0:
+            continue
+
+        # 案例長度：幾何分布，總和剛好等於本批筆數
+        n_cases = max(int(target / mean_case_length * 1.2), 1)
+        lengths = rng.geometric(1.0 / mean_case_length, n_cases)
+        lengths = lengths[:np.searchsorted(np.cumsum(lengths), target) + 1]
+        lengths[-1] -= lengths.sum() - target
+        lengths = lengths[lengths > 0]
+        n_cases = len(lengths)
+
+        # 動作序列：對所有仍在進行的案例同時抽下一步
+        max_len = lengths.max()
+        codes = np.empty((n_cases, max_len), dtype=np.int32)
+        codes[:, 0] = rng.choice(n_activities, n_cases, p=start_weights)
+        for step in range(1, max_len):
+            active = np.flatnonzero(lengths > step)
+            u = rng.random(len(active))
+            codes[active, step] = (u[:, None] > cum_transition[codes[active, step - 1]]).sum(axis=1)
+        mask = np.arange(max_len)[None, :] < lengths[:, None]
+        activity_codes = codes[mask]
+
+        # 時間：案例開始於 06:00~22:00，事件間隔為指數分布
+        case_of_row = np.repeat(np.arange(n_cases), lengths)
+        day = first_day + rng.integers(0, chunk_days, n_cases)
+        start = day * 86400 + 6 * 3600 + rng.beta(2, 2, n_cases) * 16 * 3600
+        gaps = rng.exponential(600, len(case_of_row))
+        gaps[np.r_[0, np.cumsum(lengths)[:-1]]] = 0
+        cum_gaps = np.cumsum(gaps)
+        case_offset = cum_gaps - np.repeat(cum_gaps[np.r_[0, np.cumsum(lengths)[:-1]]], lengths)
+        # 案例不跨日 (病歷號 + 日期 即為一個案例)
+        seconds = np.minimum(start[case_of_row] + case_offset, (day[case_of_row] + 1) * 86400 - 1).astype(np.int64)
+
+        chunk = pd.DataFrame({
+            '病歷號': rng.integers(1_000_000, 1_000_000 + n_patients, n_cases)[case_of_row],
+            '紀錄時間': pd.Timestamp('2024-01-01') + pd.to_timedelta(seconds, unit='s'),
+            '動作': activities[activity_codes],
+            '病房': wards[rng.choice(n_wards, n_cases, p=ward_weights)][case_of_row],
+        })
+        produced += len(chunk)
+        yield chunk.sort_values('紀錄時間', kind='stable').reset_index(drop=True)
+
+
+def write_synthetic_log(path, n_rows, **kwargs):
+    """產生合成紀錄並寫入 CSV 或 Excel (Excel 受單一工作表列數上限限制)"""
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        if n_rows > EXCEL_MAX_ROWS:
+            raise ValueError(f"Excel 單一工作表最多 {EXCEL_MAX_ROWS:,} 筆，{n_rows:,} 筆請改用 CSV")
+        df = pd.concat(iter_synthetic_chunks(n_rows, **kwargs), ignore_index=True)
+        df.to_excel(path, index=False)
+        return len(df)
+
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in iter_synthetic_chunks(n_rows, **kwargs):
+            chunk.to_csv(f, index=False, header=written == 0, date_format='%Y-%m-%d %H:%M:%S')
+            written += len(chunk)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='產生合成 ADC 事件紀錄 (欄位：病歷號, 紀錄時間, 動作, 病房)')
+    parser.add_argument('rows', help='筆數，例如 10k、100k、1M、10M')
+    parser.add_argument('output', help='輸出檔案 (.csv 或 .xlsx)')
+    parser.add_argument('--wards', type=int, default=4, help='病房數')
+    parser.add_argument('--activities', type=int, default=9, help='動作種類數')
+    parser.add_argument('--case-length', type=int, default=6, help='平均案例長度 (事件數)')
+    parser.add_argument('--days', type=int, default=90, help='資料涵蓋天數')
+    parser.add_argument('--patients', type=int, help='病人數 (預設依筆數推算)')
+    parser.add_argument('--seed', type=int, default=0, help='亂數種子')
+    args = parser.parse_args()
+
+    n_rows = parse_size(args.rows)
+    print(f"產生 {n_rows:,} 筆合成紀錄至 {args.output} ...")
+    try:
+        written = write_synthetic_log(args.output, n_rows, n_wards=args.wards, n_activities=args.activities,
+                                      mean_case_length=args.case_length, days=args.days,
+                                      n_patients=args.patients, seed=args.seed)
+    except ValueError as e:
+        print(f"錯誤：{e}")
+        sys.exit(1)
+    print(f"完成！共 {written:,} 筆 ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()